@@ -1,10 +1,16 @@
 
+import json
 import streamlit as st
 import requests
 import time
 
+from streamlit_client import (BackendError, RESULT_CACHE_ENTRIES, RESULT_CACHE_TTL, http_session, image_digest,
+                              prepare_upload)
+
 st.set_page_config(page_title="StyleAI", layout="wide")
 
+BACKEND_URL = 'http://127.0.0.1:5000'
+
 if 'page' not in st.session_state:
     st.session_state.page = 'home'
 if 'result' not in st.session_state:
@@ -37,6 +43,45 @@ def show_home():
     """, unsafe_allow_html=True)
 
 
+def wait_for_job(status_url, deadline=60, interval=0.5):
+    """Poll a backend job until it finishes; returns the last status response."""
+    give_up_at = time.monotonic() + deadline
+    while True:
+        resp = http_session().get(f'{BACKEND_URL}{status_url}', timeout=5)
+        if resp.status_code != 200 or resp.json().get('status') in ('done', 'error'):
+            return resp
+        if time.monotonic() > give_up_at:
+            raise requests.exceptions.Timeout('analysis did not finish in time')
+        time.sleep(interval)
+
+
+@st.cache_data(show_spinner=False, max_entries=RESULT_CACHE_ENTRIES, ttl=RESULT_CACHE_TTL)
+def analyze_photo(image_hash, gender, _data, _mimetype, _filename):
+    """
+    POST a photo to /analyze and wait for the result; returns (status code, body text).
+    Memoized on the photo hash and gender (arguments starting with _ are not
+    hashed), so reruns and "Try Again" with the same photo reuse the answer.
+    Results and rejections of the upload are kept; backend failures and
+    failed job polls raise BackendError.
+    """
+    upload, mimetype, filename = prepare_upload(_data, _mimetype, _filename)
+    files = {'image': (filename, upload, mimetype)}
+    # vision checks answer right away; the recommendations
+    # come from a background job that we poll
+    resp = http_session().post(f'{BACKEND_URL}/analyze?async=1', files=files, data={'gender': gender}, timeout=30)
+    if resp.status_code == 202:
+        resp = wait_for_job(resp.json()['status_url'])
+        # only the job's final answer is worth keeping; a failed poll
+        # (e.g. an unknown job id) says nothing about the photo
+        if resp.status_code != 200:
+            raise BackendError(f'{resp.status_code} - {resp.text}')
+    if resp.status_code >= 500:
+        raise BackendError(f'{resp.status_code} - {resp.text}')
+    if resp.status_code == 200 and resp.json().get('status') == 'error':
+        raise BackendError(resp.json().get('error'))
+    return resp.status_code, resp.text
+
+
 def show_upload():
     st.markdown(header_html('#E91E63'), unsafe_allow_html=True)
     st.write('')
@@ -57,16 +102,19 @@ def show_upload():
             # call backend
             with st.spinner('Analyzing your style...'):
                 try:
-                    files = {'image': (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
-                    data = {'gender': gender}
-                    resp = requests.post('http://127.0.0.1:5000/analyze', files=files, data=data, timeout=60)
-                    if resp.status_code != 200:
-                        st.error(f'Backend error: {resp.status_code} - {resp.text}')
+                    data = uploaded_file.getvalue()
+                    status, body = analyze_photo(
+                        image_digest(data), gender, data, uploaded_file.type, uploaded_file.name)
+                    if status != 200:
+                        st.error(f'Backend error: {status} - {body}')
                         return
-                    st.session_state.result = resp.json()
+                    result = json.loads(body)
+                    st.session_state.result = result.get('result', result)
                     st.session_state.page = 'results'
                     # small pause to allow UI update
                     time.sleep(0.5)
+                except BackendError as e:
+                    st.error(f'Backend error: {e}')
                 except requests.exceptions.RequestException as e:
                     st.error(f'Error connecting to backend: {e}')
 
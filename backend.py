@@ -1,311 +1,767 @@
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
-from groq import Groq
+"""
+StyleAI web backend.
+
+    flask --app backend run          # or `python backend.py` for the debug server
+    flask --app backend fetch-models # download model files once, offline from serving
+    python serve.py                  # pre-fork production server
+
+create_app(config) builds the app. Importing this module only pulls in
+Flask and the light pure-Python modules; cv2, numpy and the vision stack
+are imported when the models warm up (or by the first request that needs
+them) and the Groq SDK on the first LLM call, so a fresh worker answers
+/health within a few hundred milliseconds.
+"""
+import contextlib
+import json
 import os
+import threading
+import zipfile
+
+import click
 from dotenv import load_dotenv
-import cv2
-import numpy as np
-from skin_tone import detect_skin_tone
-from shopping_links import get_shopping_links
-
-# paths for optional OpenCV gender classification model
-GENDER_PROTO = "deploy_gender.prototxt"
-GENDER_MODEL = "gender_net.caffemodel"
-GENDER_CLASSES = ['Male', 'Female']
-_gender_net = None
-
-def _download_gender_model():
-    """Download the caffemodel and prototxt from GitHub if not present."""
-    import urllib.request
-    urls = {
-        GENDER_PROTO: "https://raw.githubusercontent.com/caffe/models/master/gender_net/deploy_gender.prototxt",
-        GENDER_MODEL: "https://github.com/caffe/models/raw/master/gender_net/gender_net.caffemodel"
+from flask import (Blueprint, Flask, Response, current_app, has_app_context, jsonify, request, send_from_directory,
+                   stream_with_context)
+from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import llm
+import metrics
+import validation
+from cache import image_key, profile_key, make_cache, SingleFlight, SQLiteCache
+from catalog import CATALOG_PATH, Catalog
+from jobs import JOB_TTL, JobQueue, CPUExecutor, QueueFull
+from metrics import span, REJECTIONS
+from prompts import AGE_CONTEXT, AGE_ALIASES, build_prompt
+from recommendation_table import RECOMMENDATION_TABLE, RecommendationTable
+from uploads import UploadRequest, ViewReader, upload_view
+from validation import validate_clip, validate_upload, check_content_length
+
+# bumped whenever the fields stored in the vision cache change
+VISION_CACHE_VERSION = 3
+
+bp = Blueprint("styleai", __name__)
+
+
+def default_config():
+    """
+    create_app() settings, read from the environment (and .env):
+    - MODEL_WARMUP: when the face detector and gender net are loaded.
+      "background" (default) starts a thread so /health answers at once and
+      reports models_ready; "eager" loads them before create_app() returns,
+      which serve.py uses so forked workers share them; "lazy" leaves it to
+      the first request that needs them. `flask` CLI commands other than
+      `run` never warm up
+    - LLM_BACKEND: "groq" or "stub"
+    - CACHE_DB: file path to keep both caches across restarts
+    - JOB_DB: file that async job states are shared through (defaults to
+      CACHE_DB); needed when several server processes answer /jobs/<id>
+    - *_CACHE_SIZE / *_CACHE_TTL, RECOMMENDATION_TABLE, CATALOG_PATH,
+      BATCH_MAX_IMAGES, BATCH_MAX_BYTES, BATCH_MAX_UNPACKED_BYTES, FRAMES_MAX,
+      FRAMES_MAX_BYTES
+    """
+    return {
+        # werkzeug aborts with a 413 as soon as a body passes this (see uploads.py)
+        "MAX_CONTENT_LENGTH": validation.MAX_REQUEST_BYTES,
+        "MODEL_WARMUP": os.getenv("MODEL_WARMUP", "background"),
+        "LLM_BACKEND": os.getenv("LLM_BACKEND", llm.LLM_BACKEND),
+        "CACHE_DB": os.getenv("CACHE_DB"),
+        "JOB_DB": os.getenv("JOB_DB") or os.getenv("CACHE_DB"),
+        "VISION_CACHE_SIZE": int(os.getenv("VISION_CACHE_SIZE", "1024")),
+        "VISION_CACHE_TTL": int(os.getenv("VISION_CACHE_TTL", "3600")),
+        "RECOMMENDATION_CACHE_SIZE": int(os.getenv("RECOMMENDATION_CACHE_SIZE", "256")),
+        "RECOMMENDATION_CACHE_TTL": int(os.getenv("RECOMMENDATION_CACHE_TTL", "86400")),
+        "RECOMMENDATION_TABLE": os.getenv("RECOMMENDATION_TABLE", RECOMMENDATION_TABLE),
+        "CATALOG_PATH": os.getenv("CATALOG_PATH", CATALOG_PATH),
+        # most images a single POST /analyze/batch may carry; use the batch CLI beyond that
+        "BATCH_MAX_IMAGES": int(os.getenv("BATCH_MAX_IMAGES", "500")),
+        # body limit for POST /analyze/batch, which replaces MAX_CONTENT_LENGTH there
+        "BATCH_MAX_BYTES": int(os.getenv("BATCH_MAX_BYTES", str(512 * 1024 * 1024))),
+        # most an uploaded archive's members may add up to once decompressed
+        "BATCH_MAX_UNPACKED_BYTES": int(os.getenv("BATCH_MAX_UNPACKED_BYTES", str(1024 * 1024 * 1024))),
+        # most photos (or sampled clip frames) POST /analyze/frames scores, and its body limit
+        "FRAMES_MAX": int(os.getenv("FRAMES_MAX", "90")),
+        "FRAMES_MAX_BYTES": int(os.getenv("FRAMES_MAX_BYTES", str(32 * 1024 * 1024))),
     }
-    for fname, url in urls.items():
-        if not os.path.exists(fname):
-            try:
-                print(f"Downloading {fname}...")
-                urllib.request.urlretrieve(url, fname)
-                print(f"Downloaded {fname}")
-            except Exception as e:
-                print(f"Failed to download {fname}: {e}")
-
-def load_gender_net():
-    global _gender_net
-    if _gender_net is None:
-        # try to ensure files exist
-        _download_gender_model()
-        if os.path.exists(GENDER_PROTO) and os.path.exists(GENDER_MODEL):
-            try:
-                _gender_net = cv2.dnn.readNetFromCaffe(GENDER_PROTO, GENDER_MODEL)
-            except Exception as e:
-                print("Error loading gender net:", e)
-                _gender_net = None
-    return _gender_net
-
-# make sure user is aware if model still missing
-if not os.path.exists(GENDER_PROTO) or not os.path.exists(GENDER_MODEL):
-    print("(Tip) deploy_gender.prototxt and/or gender_net.caffemodel missing; automatic download attempted.")
-    print("You can also manually place them in the project root for best results.")
-
-
-load_dotenv()
-
-# configure Flask to serve static files from the project root and
-# automatically register a static_url_path so that serving
-# `index.html`/`style-form.html` is easy.
-app = Flask(__name__, static_folder=".", static_url_path="")
-# allow requests from other origins (e.g. if you host the front end elsewhere)
-CORS(app)
-
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-
-# Blur detection function
-def is_image_blurry(image_path, threshold=100):
-    image = cv2.imread(image_path)
-    if image is None:
-        return True
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
-    return laplacian_var < threshold
-
-
-def detect_face_and_estimate_gender(image_path):
+
+
+class Services:
     """
-    Detect face and estimate gender using either a small DNN if available or
-    fallback to simple heuristics.
-    Returns (detected_gender, confidence) or (None, None) if no face.
+    The long-lived objects one app works with, built from its config.
+    - llm_gateway: every LLM call goes through it: timeout, in-flight cap,
+      retries and a circuit breaker in front of the Groq API (or the stub)
+    - vision_cache: vision results keyed on a hash of the upload bytes
+    - recommendation_cache: LLM answers keyed on the normalized prompt
+      profile; recommendation_flights makes concurrent misses for the same
+      profile share one call
+    - recommendation_table: answers for every profile, generated offline by
+      `python recommendation_table.py build`; served ahead of the cache and
+      the LLM unless a request asks for ?fresh=1
+    - catalog: products and shopping links, prebuilt per profile
+    - job_queue: bounded pool for the LLM stage of POST /analyze?async=1;
+      job states go to JOB_DB so any server process can answer a poll
+    - cpu_executor: decode and vision checks; when VISION_WORKERS are busy
+      and VISION_QUEUE_DEPTH more are waiting, uploads get a 503
     """
-    image = cv2.imread(image_path)
-    if image is None:
-        return None, None
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-    # face detection
-    face_cascade = cv2.CascadeClassifier(
-        cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-    )
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-    if len(faces) == 0:
-        return None, None
-    (x, y, w, h) = max(faces, key=lambda f: f[2] * f[3])
-    face_color = image[y:y+h, x:x+w]
-    face_gray = gray[y:y+h, x:x+w]
-
-    # try deep network if model files present
-    net = load_gender_net()
-    if net is not None:
-        blob = cv2.dnn.blobFromImage(face_color, 1.0, (227, 227),
-                                     (78.4263377603, 87.7689143744, 114.895847746),
-                                     swapRB=False)
-        net.setInput(blob)
-        preds = net.forward()
-        i = int(np.argmax(preds[0]))
-        detected_gender = GENDER_CLASSES[i]
-        confidence = float(preds[0][i])
-        return detected_gender, confidence
-
-    # fallback heuristics
-    aspect_ratio = w / (h + 0.001)
-    chin_roi = face_gray[int(h*0.7):, :]
-    chin_darkness = np.mean(chin_roi)
-    edges = cv2.Laplacian(face_gray, cv2.CV_64F)
-    edge_concentration = np.std(edges)
-    # debug print values
-    print(f"heuristics: aspect_ratio={aspect_ratio:.2f}, chin_darkness={chin_darkness:.1f}, edge_conc={edge_concentration:.1f}")
-    male_score = 0
-    female_score = 0
-    if aspect_ratio > 0.8:
-        male_score += 2
-    else:
-        female_score += 1
-    if chin_darkness < 110:
-        male_score += 1.5
-    if edge_concentration > 12:
-        male_score += 1
-    else:
-        female_score += 1
-    if male_score > female_score:
-        detected_gender = 'Male'
-        confidence = min(0.95, 0.5 + (male_score / 10.0))
-    else:
-        detected_gender = 'Female'
-        confidence = min(0.95, 0.5 + (female_score / 10.0))
-    return detected_gender, confidence
 
-# Generate Amazon product links based on gender and age
-def generate_amazon_links(gender, age_group):
-    base_url = "https://www.amazon.com/s?k="
-    
-    products = {
-        "Male": {
-            "0-9": {"name": "Boys Casual Outfits", "query": "boys+casual+clothes+kids"},
-            "10-15": {"name": "Teen Boys Fashion", "query": "teenage+boys+clothing"},
-            "16-25": {"name": "Men's Formal Wear", "query": "mens+formal+shirts+blazer"},
-            "25-above": {"name": "Professional Men's Suits", "query": "mens+business+suit+professional"}
-        },
-        "Female": {
-            "0-9": {"name": "Girls Casual Wear", "query": "girls+casual+dresses+kids"},
-            "10-15": {"name": "Teen Girls Fashion", "query": "teenage+girls+clothing"},
-            "16-25": {"name": "Women's Formal Wear", "query": "women+formal+blazer+dress"},
-            "25-above": {"name": "Professional Women's Suits", "query": "women+business+suit+professional"}
-        }
-    }
-    
-    # normalize common age variants
-    age_key = age_group
-    if age_group == '25+':
-        age_key = '25-above'
-
-    if gender in products and age_key in products[gender]:
-        product = products[gender][age_key]
-        return {
-            "name": product["name"],
-            "url": base_url + product["query"]
-        }
-    return {"name": "Shop Now", "url": base_url + "fashion"}
-
-
-def generate_product_list(gender, age_group, skin_tone):
-    """Return a list of sample products with shop URLs tailored to profile."""
-    base_amazon = "https://www.amazon.com/s?k="
-    # simple product keywords tuned by gender/skin_tone
-    color_hint = ''
-    if isinstance(skin_tone, str) and 'medium' in skin_tone.lower():
-        color_hint = 'navy'
-    elif isinstance(skin_tone, str) and 'light' in skin_tone.lower():
-        color_hint = 'pastel'
-    elif isinstance(skin_tone, str) and 'dark' in skin_tone.lower():
-        color_hint = 'earth+tones'
-    else:
-        color_hint = 'stylish'
+    def __init__(self, config):
+        self.llm_gateway = llm.LLMGateway(llm.make_backend(config["LLM_BACKEND"]))
+        self.vision_cache = make_cache(
+            "vision", maxsize=config["VISION_CACHE_SIZE"], ttl=config["VISION_CACHE_TTL"], db_path=config["CACHE_DB"])
+        self.recommendation_cache = make_cache(
+            "recommendations", maxsize=config["RECOMMENDATION_CACHE_SIZE"], ttl=config["RECOMMENDATION_CACHE_TTL"],
+            db_path=config["CACHE_DB"])
+        self.recommendation_flights = SingleFlight("recommendations")
+        self.recommendation_table = RecommendationTable.load(config["RECOMMENDATION_TABLE"], model=self.llm_gateway.model)
+        self.catalog = Catalog.load(config["CATALOG_PATH"])
+        job_store = SQLiteCache(config["JOB_DB"], "jobs", ttl=JOB_TTL) if config["JOB_DB"] else None
+        self.job_queue = JobQueue(store=job_store)
+        self.cpu_executor = CPUExecutor()
 
-    queries = []
-    if gender == 'Male':
-        queries = [f"{color_hint}+shirt+men", f"mens+blazer+formal", f"mens+leather+boots", f"mens+watch+silver"]
-    else:
-        queries = [f"{color_hint}+dress+women", f"womens+blazer+formal", f"womens+ankle+boots", f"womens+silver+necklace"]
 
-    products = []
-    emojis = ['👕', '👔', '👢', '⌚'] if gender == 'Male' else ['👗', '👠', '👢', '💍']
-    for i, q in enumerate(queries):
-        products.append({
-            'name': q.replace('+', ' ').title(),
-            'img': emojis[i] if i < len(emojis) else '🛍️',
-            'url': base_amazon + q
-        })
-    return products
+def services(app=None):
+    """The Services of `app`, or of the app handling the current request."""
+    return (app or current_app).extensions["styleai"]
 
 
-@app.route("/analyze", methods=["POST"])
-def analyze():
+def warm_up_models():
+    """Import the vision stack and load and warm the models; what MODEL_WARMUP schedules."""
+    import vision  # noqa: F401 - cv2, numpy and the analyzers
+    from models import registry as model_registry
+
+    model_registry.load()
+
+
+def will_serve():
+    """
+    False while a `flask` CLI command other than `run` (fetch-models, routes,
+    shell...) builds the app: no request will come, so MODEL_WARMUP is skipped.
+    """
+    ctx = click.get_current_context(silent=True)
+    return ctx is None or ctx.command.name == "run"
+
+
+def create_app(config=None):
+    """Build the Flask app; `config` entries override default_config()."""
+    load_dotenv()
+    # configure Flask to serve static files from the project root and
+    # automatically register a static_url_path so that serving
+    # `index.html`/`style-form.html` is easy.
+    app = Flask(__name__, static_folder=".", static_url_path="")
+    app.config.from_mapping(default_config())
+    app.config.from_mapping(config or {})
+    if app.config["MODEL_WARMUP"] not in ("background", "eager", "lazy"):
+        raise ValueError(f"MODEL_WARMUP must be background, eager or lazy, not {app.config['MODEL_WARMUP']!r}")
+    # uploads are parsed into one buffer and read as a memoryview (see uploads.py)
+    app.request_class = UploadRequest
+    # allow requests from other origins (e.g. if you host the front end elsewhere)
+    CORS(app)
+    # stage timings, request counters and the Server-Timing header
+    metrics.init_app(app)
+    app.extensions["styleai"] = Services(app.config)
+    app.register_blueprint(bp)
+
+    @app.cli.command("fetch-models")
+    @click.argument("names", nargs=-1)
+    def fetch_models(names):
+        """Download the gender net and face detector files (all, or NAMES such as gender, yunet, ssd)."""
+        from models import download_models
+
+        download_models(names)
+
+    warmup = app.config["MODEL_WARMUP"] if will_serve() else "lazy"
+    if warmup == "eager":
+        warm_up_models()
+    elif warmup == "background":
+        # not a daemon: exiting while OpenCV is still initializing aborts the process
+        threading.Thread(target=warm_up_models, name="model-warmup").start()
+    return app
+
+
+def collect_service_metrics():
+    if not has_app_context():
+        return []
+    svc = services()
+    return metrics.cache_collector(svc.vision_cache, svc.recommendation_cache)() + [
+        ("styleai_llm_coalesced_total", "counter", "LLM calls saved by joining an identical in-flight prompt.",
+         [({}, svc.recommendation_flights.coalesced)]),
+        ("styleai_jobs_pending", "gauge", "Async analyses queued or running.", [({}, svc.job_queue.pending())]),
+        ("styleai_vision_queue_depth", "gauge", "Vision checks running or waiting for a CPU worker.",
+         [({}, svc.cpu_executor.depth())]),
+        ("styleai_llm_breaker_open", "gauge", "1 while the LLM circuit breaker is not closed.",
+         [({}, int(svc.llm_gateway.state() != "closed"))]),
+    ]
+
+
+metrics.registry.add_collector(collect_service_metrics)
+
+
+def analyze_image(data):
+    """
+    Run the vision checks on raw upload bytes, reusing a cached result when
+    the same bytes were analyzed before.
+    Returns a dict with blurry/detected_gender/confidence/skin_tone (display
+    string)/skin_tone_detail (SkinTone.to_dict()), or None if the bytes are
+    not a decodable image.
+    """
+    from image_frame import open_image
+    from skin_tone import detect_skin_tone
+    from vision import is_image_blurry, analyze_face
+
+    vision_cache = services().vision_cache
+    key = f"{VISION_CACHE_VERSION}:{image_key(data)}"
+    cached = vision_cache.get(key)
+    if cached is not None:
+        return cached
+
+    # cheapest rejections first: a JPEG is opened from a small grayscale
+    # thumbnail, the blur check and face cascade run on that, and the full
+    # image is decoded only for gender and skin tone once a face is found
+    frame = open_image(data)
+    if frame is None:
+        return None
+
+    result = {"blurry": False, "detected_gender": None, "confidence": None,
+              "skin_tone": None, "skin_tone_detail": None}
+    with span("blur"):
+        blurry = is_image_blurry(frame)
+    if blurry:
+        result["blurry"] = True
+    else:
+        try:
+            face_box, detected_gender, gender_confidence = analyze_face(frame)
+        except ValueError:
+            # the thumbnail decoded but the full image did not (truncated upload)
+            return None
+        print(f"DEBUG gender detection: {detected_gender=} {gender_confidence=}")
+        if detected_gender is not None:
+            result["detected_gender"] = detected_gender
+            result["confidence"] = float(gender_confidence) if gender_confidence else None
+            # sample skin from the face the detector already found
+            with span("skin_tone"):
+                skin_tone = detect_skin_tone(frame, face_box)
+            result["skin_tone"] = str(skin_tone)
+            result["skin_tone_detail"] = skin_tone.to_dict()
+    vision_cache.set(key, result)
+    return result
+
+
+def fallback_recommendations(skin_label, gender, age_group, error):
+    """Templated advice for when the LLM gateway gives up; never cached."""
+    print(f"LLM unavailable ({error.kind}: {error}); sending templated recommendations")
+    llm.LLM_FALLBACKS.inc(error.kind)
+    return llm.fallback_recommendations(skin_label, gender, age_group, AGE_CONTEXT.get(age_group, "contemporary"))
+
+
+def flight_timeout(error):
+    """The LLMError a caller falls back on when the shared call it joined outlasts LLM_TIMEOUT."""
+    return llm.LLMUnavailable(str(error), kind="flight_timeout")
+
+
+def get_recommendations(skin_label, gender, age_group, fresh=False):
+    """
+    Return styling advice for a profile: from the precomputed table, else
+    the cache, else the LLM. Concurrent misses for the same profile wait for
+    one shared call, up to LLM_TIMEOUT. fresh=True always asks the LLM and does not cache.
+    """
+    svc = services()
+    if fresh:
+        try:
+            return svc.llm_gateway.complete(build_prompt(skin_label, gender, age_group), temperature=0.7)
+        except llm.LLMError as e:
+            return fallback_recommendations(skin_label, gender, age_group, e)
+    recommendations = svc.recommendation_table.get(skin_label, gender, age_group)
+    if recommendations is not None:
+        return recommendations
+
+    key = profile_key(skin_label, gender, age_group)
+    recommendations = svc.recommendation_cache.get(key)
+    if recommendations is not None:
+        return recommendations
+
+    def fetch():
+        # a flight for this key may have finished between the cache check and joining
+        cached = svc.recommendation_cache.peek(key)
+        if cached is not None:
+            return cached
+        try:
+            text = svc.llm_gateway.complete(build_prompt(skin_label, gender, age_group), temperature=0.7)
+        except llm.LLMError as e:
+            return fallback_recommendations(skin_label, gender, age_group, e)
+        svc.recommendation_cache.set(key, text)
+        return text
+
+    try:
+        return svc.recommendation_flights.do(key, fetch, timeout=llm.LLM_TIMEOUT)
+    except llm.LLMError as e:
+        # joined a stream that failed part-way
+        return fallback_recommendations(skin_label, gender, age_group, e)
+    except TimeoutError as e:
+        return fallback_recommendations(skin_label, gender, age_group, flight_timeout(e))
+
+
+def stream_recommendations(skin_label, gender, age_group, fresh=False):
+    """
+    Yield LLM styling advice for a profile chunk by chunk as the LLM generates it.
+    A precomputed or cached answer is yielded in one piece; a completed
+    stream is cached. fresh=True skips the table and cache and streams a
+    new answer that is not cached.
+    If the LLM fails before the first chunk the templated fallback is
+    yielded instead; a failure part-way through raises llm.LLMError.
+    While another request is already generating the same profile, this one
+    waits for that answer and yields it in one piece, or the fallback when
+    it takes longer than LLM_TIMEOUT.
+    """
+    svc = services()
+    if fresh:
+        parts = []
+        try:
+            for text in svc.llm_gateway.stream(build_prompt(skin_label, gender, age_group), temperature=0.7):
+                parts.append(text)
+                yield text
+        except llm.LLMError as e:
+            if parts:
+                raise
+            yield fallback_recommendations(skin_label, gender, age_group, e)
+        return
+    recommendations = svc.recommendation_table.get(skin_label, gender, age_group)
+    if recommendations is not None:
+        yield recommendations
+        return
+
+    key = profile_key(skin_label, gender, age_group)
+    recommendations = svc.recommendation_cache.get(key)
+    if recommendations is not None:
+        yield recommendations
+        return
+
+    flight, leader = svc.recommendation_flights.join(key)
+    if not leader:
+        try:
+            yield flight.wait(timeout=llm.LLM_TIMEOUT)
+        except llm.LLMError as e:
+            yield fallback_recommendations(skin_label, gender, age_group, e)
+        except TimeoutError as e:
+            yield fallback_recommendations(skin_label, gender, age_group, flight_timeout(e))
+        return
+
+    parts = []
+    result = error = None
+    try:
+        result = svc.recommendation_cache.peek(key)
+        if result is not None:
+            yield result
+            return
+        try:
+            for text in svc.llm_gateway.stream(build_prompt(skin_label, gender, age_group), temperature=0.7):
+                parts.append(text)
+                yield text
+        except llm.LLMError as e:
+            if parts:
+                error = e
+                raise
+            result = fallback_recommendations(skin_label, gender, age_group, e)
+            yield result
+            return
+        result = "".join(parts)
+        svc.recommendation_cache.set(key, result)
+    finally:
+        if result is None and error is None:
+            # the client went away mid-stream; waiting requests fall back
+            error = llm.LLMUnavailable("shared stream was abandoned", kind="abandoned")
+        svc.recommendation_flights.finish(key, flight, result=result, error=error)
+
+
+def busy_response(message, retry_after=5):
+    """503 with Retry-After for a request shed by admission control, counted in /metrics as a busy rejection."""
+    REJECTIONS.inc("busy")
+    resp = jsonify({"error": "busy", "code": "busy", "message": message})
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp, 503
+
+
+def reject(rejection):
+    """JSON error response for a validation.Rejection, counted in /metrics by its code."""
+    REJECTIONS.inc(rejection.code)
+    return jsonify(rejection.to_dict()), rejection.status
+
+
+# endpoints that raise MAX_CONTENT_LENGTH: the config key of their limit and what the request is called
+BODY_LIMITS = {
+    "styleai.analyze_batch_endpoint": ("BATCH_MAX_BYTES", "batch"),
+    "styleai.analyze_frames_endpoint": ("FRAMES_MAX_BYTES", "frames"),
+}
+
+
+@bp.app_errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    # raised while the body streams in, once it passes request.max_content_length
+    if request.endpoint in BODY_LIMITS:
+        key, kind = BODY_LIMITS[request.endpoint]
+        return reject(validation.body_too_large(kind, current_app.config[key]))
+    return reject(validation.TOO_LARGE)
+
+
+def run_vision_stage():
+    """
+    Validate the /analyze form and run the synchronous vision checks.
+    Returns (profile, None) when the photo passes, or (None, error_response)
+    with the JSON error and status code to send back.
+    Checks run cheapest first: declared body size, form fields, the header
+    checks in validation.py, then the vision stages.
+    """
+    # an oversized body is refused before the multipart form is even parsed
+    rejection = check_content_length(request.content_length)
+    if rejection is not None:
+        return None, reject(rejection)
+
     # validate input
     if "image" not in request.files or request.files["image"].filename == "":
-        return jsonify({"error": "no image provided"}), 400
+        return None, reject(validation.NO_IMAGE)
     image = request.files["image"]
     gender = request.form.get("gender", "").capitalize()
     age_group = request.form.get("age", "16-25")  # default age group
+    age_group = AGE_ALIASES.get(age_group, age_group)
 
     if gender not in ("Male", "Female"):
-        return jsonify({"error": "gender must be Male or Female"}), 400
+        return None, reject(validation.BAD_GENDER)
+
+    with span("upload"):
+        data = upload_view(image)
+    rejection = validate_upload(data, image.mimetype)
+    if rejection is not None:
+        return None, reject(rejection)
+
+    try:
+        vision = services().cpu_executor.run(analyze_image, data)
+    except QueueFull:
+        return None, busy_response("Too many photos are being analyzed. Please retry shortly.")
+    if vision is None:
+        return None, reject(validation.UNREADABLE)
 
-    image_path = "uploaded.jpg"
-    image.save(image_path)
     # Check if image is blurry
-    if is_image_blurry(image_path):
-        return jsonify({"error": "Image is too blurry. Please upload a clearer photo."}), 400
+    if vision["blurry"]:
+        return None, reject(validation.BLURRY)
 
-    # Gender verification: detect gender from face and compare with user selection
-    detected_gender, gender_confidence = detect_face_and_estimate_gender(image_path)
-    print(f"DEBUG gender detection: {detected_gender=} {gender_confidence=}")
-    
+    # Gender verification: compare the face-detected gender with user selection
+    error = check_detected_gender(gender, vision["detected_gender"], vision["confidence"])
+    if error is not None:
+        return None, error
+
+    return {
+        "skin_tone": vision["skin_tone"],
+        "skin_tone_detail": vision["skin_tone_detail"],
+        "gender": gender,
+        "age_group": age_group,
+        "detected_gender": vision["detected_gender"],
+        "confidence": vision["confidence"],
+        # ?fresh=1 (or a `fresh` form field): a newly generated answer instead of a precomputed one
+        "fresh": request.values.get("fresh") == "1",
+    }, None
+
+
+def check_detected_gender(gender, detected_gender, gender_confidence):
+    """The error response when no face was found or it differs from the selected gender, else None."""
     if detected_gender is None:
         print("DEBUG no face detected")
-        return jsonify({"error": "No face detected in the image. Please upload a clear selfie."}), 400
+        return reject(validation.NO_FACE)
     
     # If detected gender mismatches user selection, return error (no override allowed)
     if detected_gender != gender:
         # log for debugging
         print(f"Gender mismatch: selected={gender}, detected={detected_gender}, conf={gender_confidence}")
+        REJECTIONS.inc("gender_mismatch")
         resp = {
             "error": "gender_mismatch",
+            "code": "gender_mismatch",
             "message": "The uploaded photo appears to be a different gender than selected.",
             "selected_gender": gender,
             "detected_gender": detected_gender,
-            "confidence": float(gender_confidence) if gender_confidence else None
+            "confidence": gender_confidence
         }
         return jsonify(resp), 400
+    return None
+
 
-    skin_tone = detect_skin_tone(image_path)
+def build_profile_payload(profile):
+    """Everything in the /analyze payload that does not need the LLM."""
+    skin_label = profile["skin_tone_detail"]["label"]
+    gender = profile["gender"]
+    age_group = profile["age_group"]
 
-    # Age-specific prompt modifications
-    age_context = {
-        "0-9": "child-friendly, playful, colorful styles",
-        "10-15": "trendy youth styles, mix of comfort and fashion",
-        "16-25": "modern, stylish, contemporary looks",
-        "25+": "sophisticated, professional, timeless styles"
+    # also send back detection result for transparency
+    return {
+        "skin_tone": profile["skin_tone"],
+        "skin_tone_detail": profile["skin_tone_detail"],
+        "gender": gender,
+        "age_group": age_group,
+        "detected_gender": profile["detected_gender"],
+        "confidence": profile["confidence"],
+        **services().catalog.fragment(gender, age_group, skin_label),
     }
-    
-    age_desc = age_context.get(age_group, "contemporary")
-
-    prompt = f"""
-    User Profile:
-    - Skin Tone: {skin_tone}
-    - Gender: {gender}
-    - Age Group: {age_group} ({age_desc})
-
-    Provide personalized styling recommendations for this person:
-    1. Recommended Dress Codes (Formal, Business, Casual, Party)
-    2. Outfit combinations suitable for {age_desc}
-    3. Hairstyle and grooming suggestions
-    4. Accessories recommendations appropriate for their age
-    5. Color palette that complements their skin tone
-    6. Explain why these recommendations work for their profile
-
-    Make recommendations age-appropriate and skin-tone specific.
-    """
 
-    completion = client.chat.completions.create(
-        model="llama-3.3-70b-versatile",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.7
+
+def build_result(profile):
+    """Run the LLM stage for a validated profile and assemble the /analyze payload."""
+    recommendations = get_recommendations(
+        profile["skin_tone_detail"]["label"], profile["gender"], profile["age_group"], fresh=profile["fresh"]
     )
+    return {"status": "success", **build_profile_payload(profile), "recommendations": recommendations}
 
-    recommendations = completion.choices[0].message.content
-    shopping_links = get_shopping_links(gender, skin_tone)
-    amazon_link = generate_amazon_links(gender, age_group)
-    products = generate_product_list(gender, age_group, skin_tone)
 
-    # also send back detection result for transparency
-    return jsonify({
-        "status": "success",
-        "skin_tone": skin_tone,
+@bp.route("/analyze", methods=["POST"])
+def analyze():
+    profile, error = run_vision_stage()
+    if error is not None:
+        return error
+
+    # ?async=1: the vision checks above already ran; hand the slow LLM stage
+    # to the job pool and let the client poll /jobs/<id>
+    if request.args.get("async") == "1":
+        app = current_app._get_current_object()
+
+        def job():
+            with app.app_context():
+                return build_result(profile)
+
+        try:
+            job_id = services().job_queue.submit(job)
+        except QueueFull:
+            return busy_response("Too many analyses in progress. Please retry shortly.")
+        return jsonify({"status": "queued", "job_id": job_id, "status_url": f"/jobs/{job_id}"}), 202
+
+    return jsonify(build_result(profile))
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@bp.route("/analyze/stream", methods=["POST"])
+def analyze_stream():
+    """
+    Server-Sent Events variant of /analyze.
+    Rejections are ordinary JSON 400s. Accepted photos get a `profile` event
+    with skin tone, detected gender and shopping links straight away, then
+    one `token` event per Groq chunk, then `done` (or `error`).
+    """
+    profile, error = run_vision_stage()
+    if error is not None:
+        return error
+
+    def events():
+        yield sse_event("profile", build_profile_payload(profile))
+        try:
+            for text in stream_recommendations(
+                profile["skin_tone_detail"]["label"], profile["gender"], profile["age_group"], fresh=profile["fresh"]
+            ):
+                yield sse_event("token", {"text": text})
+        except Exception as e:
+            print("Recommendation stream failed:", e)
+            yield sse_event("error", {"error": "Could not generate recommendations. Please try again."})
+            return
+        yield sse_event("done", {"status": "success"})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@bp.route("/analyze/batch", methods=["POST"])
+def analyze_batch_endpoint():
+    """
+    Bulk vision analysis for many photos in one request.
+    Accepts multipart `images` files and/or one `archive` zip, and streams
+    back one JSON object per image (application/x-ndjson). Pass
+    ?recommendations=1 (and an optional `age` form field) to add the LLM stage.
+    Each image, zip members included, gets the /analyze upload checks before
+    it is decoded; one that fails is reported with the Rejection code as its
+    status. The vision work shares the CPU executor with /analyze: 503 when it is
+    full at the start, and status "busy" for the remaining images when it
+    fills up mid-stream.
+    """
+    from batch import analyze_batch, open_zip_upload, zip_member_items
+
+    # set before request.files is touched: the form is parsed under this limit
+    request.max_content_length = current_app.config["BATCH_MAX_BYTES"]
+    items = [{"id": f.filename or str(i), "source": ("bytes", upload_view(f))}
+             for i, f in enumerate(request.files.getlist("images"))]
+    max_images = current_app.config["BATCH_MAX_IMAGES"]
+    archive = request.files.get("archive")
+    if archive is not None and archive.filename:
+        # checked on the central directory; members are decompressed one chunk at a time later
+        try:
+            # read through the view: the upload's stream is closed before the response finishes streaming
+            zf, members = open_zip_upload(ViewReader(upload_view(archive)))
+        except zipfile.BadZipFile:
+            return reject(validation.BAD_ARCHIVE)
+        if len(items) + len(members) > max_images:
+            return reject(validation.too_many_images(max_images))
+        if any(info.file_size > validation.MAX_UPLOAD_BYTES for info in members):
+            return reject(validation.MEMBER_TOO_LARGE)
+        limit = current_app.config["BATCH_MAX_UNPACKED_BYTES"]
+        if sum(info.file_size for info in members) > limit:
+            return reject(validation.archive_too_large(limit))
+        items.extend(zip_member_items(zf, members))
+    if not items:
+        return reject(validation.NO_IMAGES)
+    if len(items) > max_images:
+        return reject(validation.too_many_images(max_images))
+
+    recommend = get_recommendations if request.args.get("recommendations") == "1" else None
+    age_group = request.form.get("age", "16-25")
+    age_group = AGE_ALIASES.get(age_group, age_group)
+
+    # each batch of images is decoded and analyzed on the CPU executor, like a single /analyze photo
+    records = analyze_batch(items, recommend=recommend, default_age=age_group, run=services().cpu_executor.run)
+    try:
+        first = next(records)
+    except QueueFull:
+        return busy_response("Too many photos are being analyzed. Please retry shortly.")
+
+    def lines():
+        yield json.dumps(first) + "\n"
+        sent = 1
+        try:
+            for record in records:
+                yield json.dumps(record) + "\n"
+                sent += 1
+        except QueueFull:
+            # the 200 is already out: the rest of the images are reported as busy, to be sent again
+            REJECTIONS.inc("busy")
+            for item in items[sent:]:
+                yield json.dumps({"id": item["id"], "status": "busy"}) + "\n"
+
+    return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
+
+
+@bp.route("/analyze/frames", methods=["POST"])
+def analyze_frames_endpoint():
+    """
+    /analyze for a webcam burst or a short clip instead of one photo.
+    Accepts several `frames` image files or one `video` file (MP4, MOV or
+    WebM), plus the usual gender and age fields. Frames are scored for
+    sharpness and a face until enough good ones turn up (see frames.py);
+    the gender check and the LLM then run once, for the best frame and the
+    skin tone aggregated over the good ones. The answer is the /analyze
+    payload plus a `frames` summary of the scan.
+    """
+    from frames import clip_file, clip_size, iter_image_frames, iter_video_frames, select_frames
+
+    # set before request.files is touched: the form is parsed under this limit
+    request.max_content_length = current_app.config["FRAMES_MAX_BYTES"]
+    photos = [f for f in request.files.getlist("frames") if f.filename]
+    video = request.files.get("video")
+    if video is not None and not video.filename:
+        video = None
+    if not photos and video is None:
+        return reject(validation.NO_FRAMES)
+    gender = request.form.get("gender", "").capitalize()
+    age_group = request.form.get("age", "16-25")
+    age_group = AGE_ALIASES.get(age_group, age_group)
+    if gender not in ("Male", "Female"):
+        return reject(validation.BAD_GENDER)
+    max_frames = current_app.config["FRAMES_MAX"]
+
+    with contextlib.ExitStack() as stack:
+        if video is not None:
+            data = upload_view(video)
+            rejection = validate_clip(data, video.mimetype)
+            if rejection is not None:
+                return reject(rejection)
+            path = stack.enter_context(clip_file(data, os.path.splitext(video.filename)[1] or ".mp4"))
+            size = clip_size(path)
+            if size is None:
+                return reject(validation.UNREADABLE)
+            if size[0] * size[1] > validation.MAX_IMAGE_PIXELS:
+                return reject(validation.TOO_MANY_PIXELS)
+            frames = iter_video_frames(path)
+        else:
+            if len(photos) > max_frames:
+                return reject(validation.too_many_frames(max_frames))
+            uploads = []
+            for photo in photos:
+                with span("upload"):
+                    data = upload_view(photo)
+                rejection = validate_upload(data, photo.mimetype)
+                if rejection is not None:
+                    return reject(rejection)
+                uploads.append(data)
+            frames = iter_image_frames(uploads)
+        try:
+            selection = services().cpu_executor.run(select_frames, frames, max_frames)
+        except QueueFull:
+            return busy_response("Too many photos are being analyzed. Please retry shortly.")
+
+    if not selection.accepted:
+        # a sharp frame without a face is the more useful thing to tell the user
+        if selection.scanned == selection.unreadable:
+            return reject(validation.UNREADABLE)
+        return reject(validation.NO_FACE if selection.no_face else validation.BLURRY)
+    error = check_detected_gender(gender, selection.detected_gender, selection.confidence)
+    if error is not None:
+        return error
+
+    profile = {
+        "skin_tone": str(selection.skin_tone),
+        "skin_tone_detail": selection.skin_tone.to_dict(),
         "gender": gender,
         "age_group": age_group,
-        "detected_gender": detected_gender,
-        "confidence": float(gender_confidence) if gender_confidence else None,
-        "recommendations": recommendations,
-        "shopping_links": shopping_links,
-        "amazon_link": amazon_link,
-        "products": products
-    })
+        "detected_gender": selection.detected_gender,
+        "confidence": selection.confidence,
+        "fresh": request.values.get("fresh") == "1",
+    }
+    return jsonify({**build_result(profile), "frames": selection.to_dict()})
+
+
+@bp.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = services().job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job id"}), 404
+    return jsonify({"job_id": job_id, **job}), 200
+
+
+@bp.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    svc = services()
+    return jsonify({
+        "vision": svc.vision_cache.stats(),
+        "recommendations": svc.recommendation_cache.stats(),
+        "recommendation_flights": svc.recommendation_flights.stats(),
+        "recommendation_table": svc.recommendation_table.stats(),
+    }), 200
+
+
+@bp.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
 
 
 # ---------- static frontend routes ----------
-@app.route("/health", methods=["GET"])
+@bp.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status": "Backend is running"}), 200
+    from models import registry as model_registry
+
+    return jsonify({
+        "status": "Backend is running",
+        "models_ready": model_registry.ready,
+        "gender_model": model_registry.has_gender_net,
+        "face_detector": model_registry.face_detector,
+    }), 200
 
-@app.route("/")
+@bp.route("/")
 def home():
     return send_from_directory(".", "index.html")
 
 
-@app.route("/style-form")
+@bp.route("/style-form")
 def style_form():
     return send_from_directory(".", "style-form.html")
 
 
+# development server; use `python serve.py` for the pre-fork production server
 if __name__ == "__main__":
     print("Backend starting on http://127.0.0.1:5000")
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    create_app().run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
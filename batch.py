@@ -0,0 +1,270 @@
+"""
+Bulk skin-tone and face/gender analysis for stored photos.
+
+    python -m batch photos/ --out results.jsonl
+    python -m batch photos.zip --batch-size 64 --workers 4
+    python -m batch manifest.jsonl --recommendations --age 25+
+
+The input is a directory, a zip archive or a JSONL manifest. Each manifest
+line is an object with a "path" (relative to the manifest) and optional
+"id", "gender" and "age"; lines that carry "skin_tone" and "gender" but no
+path skip the vision stage and only get recommendations.
+
+Images are read, checked and decoded in a process pool, the face detector
+and skin-tone analyzers run per image, and the gender net classifies every
+face of a batch in a single cv2.dnn.blobFromImages forward pass. The checks
+are the /analyze ones (validation.py): an image that fails one is reported
+with its Rejection code as the status and never decoded. One JSON object per
+input is written as soon as its batch finishes.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from image_frame import open_image
+from models import registry as model_registry
+from skin_tone import detect_skin_tone
+from validation import UNREADABLE, validate_upload
+from vision import is_image_blurry, detect_face, predict_genders, estimate_gender_heuristic
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def read_source(source):
+    """
+    The raw bytes of one image source, or None when it cannot be read.
+    A source is ("file", path), ("zip", archive_path, member), ("bytes", data)
+    or ("member", open ZipFile, ZipInfo); the last one only works in-process.
+    """
+    try:
+        kind = source[0]
+        if kind == "file":
+            with open(source[1], "rb") as f:
+                return f.read()
+        if kind == "zip":
+            with zipfile.ZipFile(source[1]) as zf:
+                return zf.read(source[2])
+        if kind == "member":
+            # decompressed only now, and never past the member's declared file_size
+            with source[1].open(source[2]) as f:
+                return f.read()
+        return source[1]
+    except (OSError, KeyError, RuntimeError, zipfile.BadZipFile, zlib.error):
+        # RuntimeError: encrypted member, NotImplementedError: unknown compression
+        return None
+
+
+def decode_source(source):
+    """
+    Load, check and open one image source; runs inside the process pool.
+    The bytes go through the same pre-decode checks as an /analyze upload
+    (validation.validate_upload) and a JPEG is opened from its thumbnail
+    (image_frame.open_image). Returns (ImageFrame, None), or (None, status)
+    with the Rejection code the image failed on.
+    """
+    data = read_source(source)
+    if data is None:
+        return None, UNREADABLE.code
+    rejection = validate_upload(data)
+    if rejection is not None:
+        return None, rejection.code
+    frame = open_image(data)
+    if frame is None:
+        return None, UNREADABLE.code
+    return frame, None
+
+
+def _is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def iter_directory(path):
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            if _is_image(name):
+                full = os.path.join(root, name)
+                yield {"id": os.path.relpath(full, path), "source": ("file", full)}
+
+
+def iter_zip(path):
+    with zipfile.ZipFile(path) as zf:
+        names = [info.filename for info in zf.infolist() if not info.is_dir() and _is_image(info.filename)]
+    for name in names:
+        yield {"id": name, "source": ("zip", path, name)}
+
+
+def open_zip_upload(fileobj):
+    """
+    An uploaded archive and its image members (ZipInfo), read from the
+    central directory alone, so the caller can check member count and
+    declared sizes before anything is decompressed.
+    """
+    zf = zipfile.ZipFile(fileobj)
+    return zf, [info for info in zf.infolist() if not info.is_dir() and _is_image(info.filename)]
+
+
+def zip_member_items(zf, members):
+    """Items for open_zip_upload() members; each is decompressed when its chunk is decoded."""
+    return [{"id": info.filename, "source": ("member", zf, info)} for info in members]
+
+
+def iter_manifest(path):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            item = {key: entry[key] for key in ("gender", "age", "skin_tone") if key in entry}
+            item["id"] = entry.get("id", entry.get("path", f"line-{line_no}"))
+            if "path" in entry:
+                item["source"] = ("file", os.path.join(base, entry["path"]))
+            yield item
+
+
+def iter_inputs(path):
+    """Pick the right reader for a directory, a .zip archive or a .jsonl manifest."""
+    if os.path.isdir(path):
+        return iter_directory(path)
+    if zipfile.is_zipfile(path):
+        return iter_zip(path)
+    if path.endswith((".jsonl", ".ndjson")):
+        return iter_manifest(path)
+    raise ValueError(f"{path} is not a directory, zip archive or JSONL manifest")
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _analyze_chunk(chunk, opened):
+    """Run the vision stage for one batch; `opened` are the decode_source() results for items with a source."""
+    records = []
+    pending = []  # (record, frame, box) still waiting for a gender prediction
+    decoded = iter(opened)
+    with model_registry.acquire() as models:
+        for item in chunk:
+            record = {"id": item["id"]}
+            records.append(record)
+            if "source" not in item:
+                # profile-only manifest line: nothing to look at
+                record.update(status="ok", skin_tone=item.get("skin_tone"), detected_gender=None, confidence=None)
+                continue
+            frame, status = next(decoded)
+            if frame is None:
+                record["status"] = status
+                continue
+            if is_image_blurry(frame):
+                record["status"] = "blurry"
+                continue
+            try:
+                # on a thumbnail-opened JPEG this decodes the full pixels
+                box = detect_face(frame, models)
+            except ValueError:
+                # the thumbnail decoded but the full image did not (truncated file)
+                record["status"] = UNREADABLE.code
+                continue
+            if box is None:
+                record["status"] = "no_face"
+                continue
+            skin_tone = detect_skin_tone(frame, box)
+            record["skin_tone"] = str(skin_tone)
+            record["skin_tone_detail"] = skin_tone.to_dict()
+            pending.append((record, frame, box))
+
+        # one forward pass for every face in the batch
+        if models.gender_net is not None and pending:
+            crops = [frame.bgr[y:y+h, x:x+w] for _, frame, (x, y, w, h) in pending]
+            genders = predict_genders(models.gender_net, crops)
+        else:
+            genders = [estimate_gender_heuristic(frame, box) for _, frame, box in pending]
+    for (record, _, _), (detected_gender, confidence) in zip(pending, genders):
+        record.update(status="ok", detected_gender=detected_gender, confidence=confidence)
+    return records
+
+
+def _vision_stage(chunk, pool=None):
+    """Decode one batch and run the vision stage on it; the decoded frames are dropped on return."""
+    sources = [item["source"] for item in chunk if "source" in item]
+    opened = list(pool.map(decode_source, sources)) if pool is not None else [decode_source(s) for s in sources]
+    return _analyze_chunk(chunk, opened)
+
+
+def analyze_batch(items, batch_size=32, pool=None, recommend=None, default_age="16-25", run=None):
+    """
+    Analyze input items in batches and yield one result dict per item, in order.
+    - pool: optional executor used to read and decode images in parallel
+    - recommend: optional callable(skin_label, gender, age_group) for the LLM
+      stage; it only runs for items that passed the vision stage
+    - run: optional callable(fn, *args) each batch's decode and vision stage
+      go through, e.g. a jobs.CPUExecutor's run; its errors propagate
+    """
+    for chunk in _chunks(items, batch_size):
+        records = run(_vision_stage, chunk, pool) if run is not None else _vision_stage(chunk, pool)
+        for item, record in zip(chunk, records):
+            gender = item.get("gender") or record.get("detected_gender")
+            detail = record.get("skin_tone_detail")
+            # profile-only manifest lines give the label directly
+            skin_label = detail["label"] if detail else record.get("skin_tone")
+            if recommend is not None and record["status"] == "ok" and skin_label and gender:
+                age_group = item.get("age", default_age)
+                try:
+                    record["recommendations"] = recommend(skin_label, gender, age_group)
+                except Exception as e:
+                    record["recommendations_error"] = str(e)
+            yield record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk skin-tone and face/gender analysis.")
+    parser.add_argument("input", help="directory, zip archive or JSONL manifest")
+    parser.add_argument("--out", help="JSONL output file (default: stdout)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="decoder processes; 0 decodes in the main process")
+    parser.add_argument("--recommendations", action="store_true",
+                        help="also fetch LLM recommendations for every accepted profile")
+    parser.add_argument("--age", default="16-25", help="age group for items that do not set one")
+    args = parser.parse_args(argv)
+
+    out = open(args.out, "w") if args.out else sys.stdout
+    pool = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 0 else None
+    counts = {}
+    try:
+        # keep the JSONL stream clean: debug prints from the analyzers go to stderr
+        with contextlib.redirect_stdout(sys.stderr), contextlib.ExitStack() as stack:
+            recommend = None
+            if args.recommendations:
+                # only pull in the web app when the LLM stage is wanted; its
+                # gateway, caches and precomputed table live on the app
+                from backend import create_app, get_recommendations as recommend
+                stack.enter_context(create_app({"MODEL_WARMUP": "lazy"}).app_context())
+            model_registry.load()
+            for record in analyze_batch(iter_inputs(args.input), args.batch_size, pool, recommend, args.age):
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                counts[record["status"]] = counts.get(record["status"], 0) + 1
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if out is not sys.stdout:
+            out.close()
+    print("batch summary:", json.dumps(counts), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
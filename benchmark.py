@@ -0,0 +1,666 @@
+"""
+Benchmarks for the vision and recommendation pipeline.
+
+    python benchmark.py resolution
+    python benchmark.py resolution --sizes 1024 4000 8000 --analysis-sides 0 640 --repeat 5
+    python benchmark.py detectors
+    python benchmark.py startup --budget-ms 1000
+    python benchmark.py frames --seconds 2 8 30
+    python benchmark.py suite --out bench.json
+    python benchmark.py suite --out bench.json --baseline baseline.json
+    python benchmark.py compare baseline.json bench.json --tolerance 0.15
+
+`resolution` builds phone-sized test photos from sample_male.jpg (a 4:3
+frame with the face in the middle, plus a blurred copy of each) and runs
+decode + blur check + face detection + gender + skin tone at several
+analysis resolutions. Analysis side 0 is the old full-resolution path.
+Accuracy is reported against that full-resolution run on the same photo:
+face box IoU, agreement of the gender and skin-tone label, and whether the
+sharp/blurred copies get the right blur verdict.
+
+`detectors` runs every face detector engine whose model files are present
+(see detectors.py) on the sample photos FACE_DETECTOR=auto scores them on,
+reporting recall and false positives, then times each on generated photos
+of several sizes.
+
+`suite` is the regression harness. It generates a corpus of photos at
+several resolutions with 0, 1 or 2 faces, times each analyzer on it
+directly, then drives POST /analyze through the Flask test client at
+several concurrency levels with the LLM backend replaced by a stub that answers after
+--llm-delay seconds, and posts each corpus photo once more on its own to
+record the peak memory a single request allocates (tracemalloc, which
+covers Python objects and numpy/OpenCV arrays but not OpenCV's scratch
+buffers). Throughput, p50/p95/p99 latency, peak RSS and per-request peak
+memory go to a JSON file; `compare` (or --baseline) diffs two such files and exits 1 when
+a latency or throughput figure regressed by more than --tolerance.
+
+`frames` posts generated 720p clips of several lengths to /analyze/frames,
+blurry until the last second, so the scan cannot stop early until then,
+and reports latency, frames scanned and the peak memory the request
+allocated, which should not grow with the clip length.
+
+`startup` (also part of `suite`) starts fresh interpreters that import
+backend, call create_app() and serve one /health, and fails when the median
+time to that response is over --startup-budget-ms or when importing backend
+already loaded cv2, numpy or the Groq SDK.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+import cv2
+import numpy as np
+
+from image_frame import decode_image, open_image
+import detectors
+from models import MODEL_DIR, registry as model_registry
+from skin_tone import detect_skin_tone
+from vision import is_image_blurry, detect_face, estimate_gender, analyze_face, detect_face_and_estimate_gender
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample_male.jpg")
+RESULTS_VERSION = 1
+AGE_GROUPS = ("0-9", "10-15", "16-25", "25+")
+# figures `compare` checks, and whether a larger value is better
+COMPARED_FIGURES = (("p50_ms", False), ("p95_ms", False), ("throughput_rps", True), ("peak_mb", False),
+                    ("ready_ms", False))
+# modules `import backend` must leave to create_app()'s warm-up or the first request
+HEAVY_MODULES = ("cv2", "numpy", "groq", "httpx")
+# run in a fresh interpreter by bench_startup; prints one "startup {json}" line
+STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import backend
+imported = time.perf_counter()
+heavy = [name for name in %r if name in sys.modules]
+app = backend.create_app()
+created = time.perf_counter()
+status = app.test_client().get("/health").status_code
+ready = time.perf_counter()
+print("startup", json.dumps({"import_ms": (imported - start) * 1000, "create_app_ms": (created - imported) * 1000,
+                  "ready_ms": (ready - start) * 1000, "status": status, "heavy_modules": heavy}), flush=True)
+""" % (HEAVY_MODULES,)
+
+
+def bench_detectors(sizes, repeat):
+    """Recall on the auto-selection samples and latency per photo size, for each available engine."""
+    base = cv2.imread(SAMPLE_IMAGE)
+    thumbnails = [open_image(make_photo(base, long_side)).small_gray for long_side in sizes]
+    scores = {name: rest for name, *rest in detectors.score_engines(MODEL_DIR)}
+
+    print(f"{'engine':<8} {'recall':>6} {'false +':>7} {'sample ms':>9}" + "".join(f" {f'{s}px ms':>10}" for s in sizes))
+    for name, engine in detectors.ENGINES.items():
+        if name not in scores:
+            print(f"{name:<8} not installed (flask --app backend fetch-models {name})")
+            continue
+        recall, false_positives, sample_ms = scores[name]
+        detector = engine(engine.read_files(MODEL_DIR))
+        detector.warm_up()
+        cells = []
+        for gray in thumbnails:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                detector.detect(gray)
+                timings.append((time.perf_counter() - start) * 1000)
+            cells.append(f" {statistics.median(timings):10.1f}")
+        print(f"{name:<8} {recall:6.2f} {false_positives:7d} {sample_ms:9.1f}" + "".join(cells))
+    chosen = detectors.pick_engine(list((name, *rest) for name, rest in scores.items()))
+    print(f"\nFACE_DETECTOR=auto picks {chosen} (target recall {detectors.FACE_DETECTOR_MIN_RECALL:.2f})")
+
+
+def make_photo(base, long_side, blurred=False, faces=1):
+    """
+    JPEG bytes of a 4:3 photo `long_side` pixels wide with `faces` copies of
+    the sample face side by side. With faces=0 the sample is cut into tiles
+    and shuffled: the same colours and texture, but nothing face-shaped.
+    """
+    height = long_side * 3 // 4
+    if faces:
+        side = min(height, long_side // faces)
+        face = cv2.resize(base, (side, side), interpolation=cv2.INTER_CUBIC)
+        row = cv2.hconcat([face] * faces)
+    else:
+        row = shuffled_tiles(cv2.resize(base, (height, height), interpolation=cv2.INTER_CUBIC))
+    top = (height - row.shape[0]) // 2
+    pad = (long_side - row.shape[1]) // 2
+    photo = cv2.copyMakeBorder(row, top, height - row.shape[0] - top, pad, long_side - row.shape[1] - pad,
+                               cv2.BORDER_REFLECT)
+    if blurred:
+        photo = cv2.GaussianBlur(photo, (0, 0), sigmaX=long_side / 150)
+    ok, buf = cv2.imencode(".jpg", photo, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    if not ok:
+        raise RuntimeError("could not encode benchmark image")
+    return buf.tobytes()
+
+
+def shuffled_tiles(img, grid=8, seed=0):
+    """`img` cut into a grid x grid mosaic and shuffled with a fixed seed."""
+    h, w = img.shape[:2]
+    th, tw = h // grid, w // grid
+    tiles = [img[r * th:(r + 1) * th, c * tw:(c + 1) * tw] for r in range(grid) for c in range(grid)]
+    random.Random(seed).shuffle(tiles)
+    return cv2.vconcat([cv2.hconcat(tiles[r * grid:(r + 1) * grid]) for r in range(grid)])
+
+
+def run_pipeline(data, analysis_side):
+    """One pass of the vision stage; returns (blurry, face box on the decoded image, gender, skin label, decoded width)."""
+    # side 0 reproduces the old path: full decode, full-resolution analysis;
+    # other sides take the /analyze path (thumbnail first, lazy full decode)
+    if analysis_side:
+        frame = open_image(data, analysis_max_side=analysis_side)
+    else:
+        frame = decode_image(data, analysis_max_side=0, detail_max_side=0)
+    blurry = is_image_blurry(frame)
+    with model_registry.acquire() as models:
+        box = detect_face(frame, models)
+        gender = estimate_gender(frame, box, models)[0] if box is not None else None
+    skin = detect_skin_tone(frame, box).label if box is not None else None
+    return blurry, box, gender, skin, frame.width
+
+
+def iou(a, b, scale_b=1.0):
+    """Intersection-over-union of two (x, y, w, h) boxes; `b` is first multiplied by scale_b."""
+    if a is None or b is None:
+        return 0.0
+    bx, by, bw, bh = (v * scale_b for v in b)
+    ix = max(0.0, min(a[0] + a[2], bx + bw) - max(a[0], bx))
+    iy = max(0.0, min(a[1] + a[3], by + bh) - max(a[1], by))
+    inter = ix * iy
+    union = a[2] * a[3] + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+def bench_resolution(sizes, analysis_sides, repeat):
+    base = cv2.imread(SAMPLE_IMAGE)
+    if base is None:
+        raise SystemExit(f"could not read {SAMPLE_IMAGE}")
+    model_registry.load()
+    # the heuristic gender fallback prints debug lines; keep them out of the table
+    quiet = contextlib.redirect_stdout(io.StringIO())
+
+    print(f"{'photo':>11} {'analysis':>8} {'p50 ms':>8} {'max ms':>8} {'IoU':>5} {'gender':>6} {'skin':>5} {'blur ok':>7}")
+    for long_side in sizes:
+        sharp = make_photo(base, long_side)
+        blurred = make_photo(base, long_side, blurred=True)
+        reference = None
+        for analysis_side in analysis_sides:
+            timings = []
+            with quiet:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    result = run_pipeline(sharp, analysis_side)
+                    timings.append((time.perf_counter() - start) * 1000)
+                blurred_verdict = run_pipeline(blurred, analysis_side)[0]
+            blurry, box, gender, skin, width = result
+            blur_ok = not blurry and blurred_verdict
+            if reference is None:
+                reference = result
+            ref_box, ref_width = reference[1], reference[4]
+            print(
+                f"{long_side}x{long_side * 3 // 4:<6} {analysis_side or 'full':>8} "
+                f"{statistics.median(timings):8.1f} {max(timings):8.1f} "
+                f"{iou(ref_box, box, ref_width / width):5.2f} "
+                f"{'same' if gender == reference[2] else 'diff':>6} "
+                f"{'same' if skin == reference[3] else 'diff':>5} "
+                f"{'yes' if blur_ok else 'no':>7}"
+            )
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, int(np.ceil(q / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def summarize(timings_ms):
+    return {
+        "n": len(timings_ms),
+        "mean_ms": round(statistics.fmean(timings_ms), 3),
+        "p50_ms": round(percentile(timings_ms, 50), 3),
+        "p95_ms": round(percentile(timings_ms, 95), 3),
+        "p99_ms": round(percentile(timings_ms, 99), 3),
+    }
+
+
+def current_rss():
+    """Resident set size of this process in bytes (Linux), or None."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class RssSampler:
+    """
+    Tracks peak RSS over a block by polling /proc every `interval` seconds.
+    Where /proc is unavailable it falls back to the process-lifetime peak
+    from getrusage, which can only grow between blocks.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss() or 0)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if current_rss() is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, current_rss() or 0)
+        else:
+            # ru_maxrss is in KiB on Linux
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    @property
+    def peak_mb(self):
+        return round(self.peak / 2 ** 20, 1)
+
+
+def build_corpus(sizes, face_counts):
+    """List of {"name", "data", "faces", "size"} generated from the sample image."""
+    base = cv2.imread(SAMPLE_IMAGE)
+    if base is None:
+        raise SystemExit(f"could not read {SAMPLE_IMAGE}")
+    corpus = []
+    for long_side in sizes:
+        for faces in face_counts:
+            corpus.append({
+                "name": f"{long_side}x{long_side * 3 // 4}/{faces}face",
+                "data": make_photo(base, long_side, faces=faces),
+                "faces": faces,
+                "size": long_side,
+            })
+    return corpus
+
+
+def bench_analyzers(corpus, repeat):
+    """Time decode and each analyzer on every corpus image, one fresh frame per repetition."""
+    from catalog import Catalog
+
+    catalog = Catalog.load()
+
+    results = []
+    for item in corpus:
+        timings = {"decode_image": [], "is_image_blurry": [], "detect_face_and_estimate_gender": [],
+                   "detect_skin_tone": []}
+        gender, skin_label = None, None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            frame = decode_image(item["data"])
+            timings["decode_image"].append((time.perf_counter() - start) * 1000)
+            # same order as a request, so lazily built views are paid for once
+            start = time.perf_counter()
+            is_image_blurry(frame)
+            timings["is_image_blurry"].append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            gender, _ = detect_face_and_estimate_gender(frame)
+            timings["detect_face_and_estimate_gender"].append((time.perf_counter() - start) * 1000)
+            box = analyze_face(frame)[0]
+            start = time.perf_counter()
+            skin_label = detect_skin_tone(frame, box).label
+            timings["detect_skin_tone"].append((time.perf_counter() - start) * 1000)
+        item["gender"] = gender
+        for analyzer, values in timings.items():
+            results.append({"analyzer": analyzer, "image": item["name"], **summarize(values)})
+
+        product_timings = []
+        for _ in range(repeat):
+            for age_group in AGE_GROUPS:
+                start = time.perf_counter()
+                catalog.fragment(gender or "Male", age_group, skin_label)
+                product_timings.append((time.perf_counter() - start) * 1000)
+        results.append({"analyzer": "catalog_fragment", "image": item["name"], **summarize(product_timings)})
+    return results
+
+
+def bench_app(corpus, concurrency_levels, n_requests, llm_delay, cache_mode):
+    """Drive POST /analyze at each concurrency level; returns one result dict per level."""
+    import backend
+    from llm import StubBackend
+
+    config = {"MODEL_WARMUP": "eager"}
+    if cache_mode == "cold":
+        # a zero-size LRU stores nothing, so every request runs the vision
+        # checks and the (stubbed) LLM call
+        config.update(VISION_CACHE_SIZE=0, VISION_CACHE_TTL=0, RECOMMENDATION_CACHE_SIZE=0,
+                      RECOMMENDATION_CACHE_TTL=0, CACHE_DB=None)
+    app = backend.create_app(config)
+    stub = StubBackend(delay=llm_delay)
+    backend.services(app).llm_gateway.backend = stub
+
+    def post(i):
+        item = corpus[i % len(corpus)]
+        form = {
+            "gender": item.get("gender") or "Male",
+            "age": AGE_GROUPS[i % len(AGE_GROUPS)],
+            "image": (io.BytesIO(item["data"]), f"{i}.jpg"),
+        }
+        start = time.perf_counter()
+        with app.test_client() as client:
+            resp = client.post("/analyze", data=form, content_type="multipart/form-data")
+        return (time.perf_counter() - start) * 1000, resp.status_code
+
+    post(0)  # warm-up
+    results = []
+    for workers in concurrency_levels:
+        calls_before = stub.calls
+        with RssSampler() as rss, ThreadPoolExecutor(max_workers=workers) as pool:
+            start = time.perf_counter()
+            outcomes = list(pool.map(post, range(n_requests)))
+            elapsed = time.perf_counter() - start
+        statuses = {}
+        for _, status in outcomes:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        results.append({
+            "endpoint": "/analyze",
+            "concurrency": workers,
+            "throughput_rps": round(n_requests / elapsed, 3),
+            **summarize([ms for ms, _ in outcomes]),
+            "peak_rss_mb": rss.peak_mb,
+            "statuses": statuses,
+            "llm_calls": stub.calls - calls_before,
+        })
+    return results
+
+
+def bench_request_memory(corpus):
+    """Peak memory allocated while serving one cold /analyze request, per corpus photo."""
+    import backend
+    from llm import StubBackend
+    from uploads import UPLOAD_SPOOL_BYTES
+    from werkzeug.test import EnvironBuilder
+
+    app = backend.create_app({"MODEL_WARMUP": "eager", "VISION_CACHE_SIZE": 0, "VISION_CACHE_TTL": 0,
+                              "RECOMMENDATION_CACHE_SIZE": 0, "RECOMMENDATION_CACHE_TTL": 0, "CACHE_DB": None})
+    backend.services(app).llm_gateway.backend = StubBackend()
+    results = []
+    tracemalloc.start()
+    try:
+        for item in corpus:
+            form = {"gender": item.get("gender") or "Male", "age": "16-25",
+                    "image": (io.BytesIO(item["data"]), "upload.jpg")}
+            # the multipart body is built before measuring: that is the
+            # client's memory, not the server's
+            environ = EnvironBuilder(path="/analyze", method="POST", data=form).get_environ()
+            with app.test_client() as client:
+                tracemalloc.reset_peak()
+                base, _ = tracemalloc.get_traced_memory()
+                resp = client.open(environ)
+                _, peak = tracemalloc.get_traced_memory()
+            results.append({
+                "upload": item["name"],
+                "bytes": len(item["data"]),
+                # UploadBuffer spools when the declared body is over the threshold
+                "spooled": int(environ["CONTENT_LENGTH"]) > UPLOAD_SPOOL_BYTES,
+                "status": resp.status_code,
+                "peak_mb": round((peak - base) / (1024 * 1024), 2),
+            })
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+def make_clip(base, path, seconds, fps=30, size=(1280, 720)):
+    """Write an MP4 of the sample face: blurred until its last second, sharp after."""
+    sharp = cv2.imdecode(np.frombuffer(make_photo(base, size[0]), np.uint8), cv2.IMREAD_COLOR)
+    sharp = cv2.resize(sharp, size, interpolation=cv2.INTER_AREA)
+    blurred = cv2.GaussianBlur(sharp, (0, 0), sigmaX=size[0] / 150)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    try:
+        for i in range(int(seconds * fps)):
+            writer.write(blurred if i < (seconds - 1) * fps else sharp)
+    finally:
+        writer.release()
+
+
+def bench_frames(seconds_list):
+    """Latency and peak allocation of POST /analyze/frames for clips of each length."""
+    import tempfile
+    import backend
+    from llm import StubBackend
+
+    app = backend.create_app({"MODEL_WARMUP": "eager", "VISION_CACHE_SIZE": 0, "RECOMMENDATION_CACHE_SIZE": 0,
+                              "CACHE_DB": None, "FRAMES_MAX_BYTES": 512 * 1024 * 1024, "FRAMES_MAX": 100000})
+    backend.services(app).llm_gateway.backend = StubBackend()
+    base = cv2.imread(SAMPLE_IMAGE)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for seconds in seconds_list:
+            path = os.path.join(tmp, f"{seconds}s.mp4")
+            make_clip(base, path, seconds)
+            with open(path, "rb") as f:
+                data = f.read()
+            with app.test_client() as client, contextlib.redirect_stdout(io.StringIO()):
+                tracemalloc.start()
+                start = time.perf_counter()
+                resp = client.post("/analyze/frames", data={"gender": "Male", "video": (io.BytesIO(data), "clip.mp4")})
+                elapsed = (time.perf_counter() - start) * 1000
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            results.append({"clip_s": seconds, "bytes": len(data), "status": resp.status_code, "ms": round(elapsed, 1),
+                            **(resp.get_json().get("frames") or {}), "peak_mb": round(peak / (1024 * 1024), 2)})
+
+    print(f"{'clip s':>6} {'KB':>7} {'status':>6} {'ms':>8} {'scanned':>7} {'early':>6} {'peak MB':>8}")
+    for e in results:
+        print(f"{e['clip_s']:>6} {e['bytes'] // 1024:7d} {e['status']:>6} {e['ms']:8.1f} {e.get('scanned', '-'):>7} "
+              f"{str(e.get('stopped_early', '-')):>6} {e['peak_mb']:8.2f}")
+    return results
+
+
+def bench_startup(runs, budget_ms):
+    """
+    Median import, create_app() and first-/health times of a fresh worker
+    process, with the default background model warm-up.
+    """
+    probes = []
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-c", STARTUP_PROBE], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+        if proc.returncode != 0:
+            raise SystemExit(f"startup probe failed:\n{proc.stderr}")
+        line = next(line for line in proc.stdout.splitlines() if line.startswith("startup "))
+        probes.append(json.loads(line.split(" ", 1)[1]))
+    entry = {"startup": "backend", "runs": runs}
+    for figure in ("import_ms", "create_app_ms", "ready_ms"):
+        entry[figure] = round(statistics.median(p[figure] for p in probes), 1)
+    entry["statuses"] = sorted({p["status"] for p in probes})
+    entry["heavy_modules"] = sorted({name for p in probes for name in p["heavy_modules"]})
+    entry["budget_ms"] = budget_ms
+    entry["within_budget"] = entry["ready_ms"] <= budget_ms and not entry["heavy_modules"]
+    return [entry]
+
+
+def print_startup(startup):
+    print(f"{'import ms':>10} {'create ms':>10} {'ready ms':>9} {'budget ms':>10}  heavy imports")
+    for e in startup:
+        flag = "" if e["within_budget"] else "  OVER BUDGET"
+        print(f"{e['import_ms']:10.1f} {e['create_app_ms']:10.1f} {e['ready_ms']:9.1f} {e['budget_ms']:10.0f}  "
+              f"{', '.join(e['heavy_modules']) or '-'}{flag}")
+
+
+def result_key(entry):
+    if "startup" in entry:
+        return f"startup {entry['startup']}"
+    if "analyzer" in entry:
+        return f"{entry['analyzer']} {entry['image']}"
+    if "upload" in entry:
+        return f"memory {entry['upload']}"
+    return f"{entry['endpoint']} c={entry['concurrency']}"
+
+
+def compare_results(baseline, current, tolerance):
+    """Print a per-entry diff of two suite results; returns the number of regressions."""
+    sections = ("startup", "analyzers", "app", "memory")
+    base_entries = {result_key(e): e for section in sections for e in baseline.get(section, [])}
+    regressions = 0
+    print(f"{'benchmark':<52} {'figure':>14} {'baseline':>10} {'current':>10} {'change':>8}")
+    for entry in (e for section in sections for e in current.get(section, [])):
+        key = result_key(entry)
+        old = base_entries.get(key)
+        if old is None:
+            print(f"{key:<52} {'(new)':>14}")
+            continue
+        for figure, higher_is_better in COMPARED_FIGURES:
+            if figure not in entry or not old.get(figure):
+                continue
+            change = entry[figure] / old[figure] - 1
+            worse = -change if higher_is_better else change
+            flag = "  REGRESSED" if worse > tolerance else ""
+            regressions += bool(flag)
+            print(f"{key:<52} {figure:>14} {old[figure]:10.2f} {entry[figure]:10.2f} {change:+8.1%}{flag}")
+    print(f"{regressions} regression(s) beyond {tolerance:.0%}")
+    return regressions
+
+
+def bench_suite(args):
+    # before anything in this process warms the OS file cache for the probes
+    startup = bench_startup(args.startup_runs, args.startup_budget_ms)
+    model_registry.load()
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    corpus = build_corpus(args.sizes, args.faces)
+    with quiet:
+        analyzers = bench_analyzers(corpus, args.repeat)
+        app_results = bench_app(corpus, args.concurrency, args.requests, args.llm_delay, args.cache)
+        memory = bench_request_memory(corpus)
+
+    results = {
+        "version": RESULTS_VERSION,
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "gender_model": model_registry.has_gender_net,
+            "face_detector": model_registry.face_detector,
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+        },
+        "startup": startup,
+        "analyzers": analyzers,
+        "app": app_results,
+        "memory": memory,
+    }
+
+    print_startup(startup)
+    print(f"\n{'analyzer':<34} {'image':<18} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for e in analyzers:
+        print(f"{e['analyzer']:<34} {e['image']:<18} {e['p50_ms']:8.2f} {e['p95_ms']:8.2f} {e['p99_ms']:8.2f}")
+    print(f"\n{'concurrency':>11} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RSS MB':>8}  statuses")
+    for e in app_results:
+        print(f"{e['concurrency']:>11} {e['throughput_rps']:8.2f} {e['p50_ms']:8.1f} {e['p95_ms']:8.1f} "
+              f"{e['p99_ms']:8.1f} {e['peak_rss_mb']:8.1f}  {e['statuses']}")
+    print(f"\n{'upload':<18} {'KB':>8} {'spooled':>8} {'status':>6} {'peak MB':>8}")
+    for e in memory:
+        print(f"{e['upload']:<18} {e['bytes'] // 1024:8d} {str(e['spooled']):>8} {e['status']:>6} {e['peak_mb']:8.2f}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nresults written to {args.out}")
+    failed = not all(e["within_budget"] for e in startup)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        failed |= bool(compare_results(baseline, results, args.tolerance))
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vision pipeline benchmarks.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    res = sub.add_parser("resolution", help="latency and accuracy at several analysis resolutions")
+    res.add_argument("--sizes", type=int, nargs="+", default=[1024, 2048, 4000, 8000],
+                     help="long side of the generated photos (4000 ~ 12 MP, 8000 ~ 48 MP)")
+    res.add_argument("--analysis-sides", type=int, nargs="+", default=[0, 1280, 640, 480, 320],
+                     help="ANALYSIS_MAX_SIDE values to compare; 0 = full resolution, no reduced decode")
+    res.add_argument("--repeat", type=int, default=3)
+
+    suite = sub.add_parser("suite", help="analyzer and /analyze benchmarks with JSON results")
+    suite.add_argument("--sizes", type=int, nargs="+", default=[640, 1600, 4000],
+                       help="long side of the generated corpus photos")
+    suite.add_argument("--faces", type=int, nargs="+", default=[0, 1, 2], help="face counts in the corpus")
+    suite.add_argument("--repeat", type=int, default=5, help="timed runs per analyzer and image")
+    suite.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16],
+                       help="concurrent /analyze clients per level")
+    suite.add_argument("--requests", type=int, default=48, help="/analyze requests per concurrency level")
+    suite.add_argument("--llm-delay", type=float, default=0.2, help="seconds the stub LLM backend takes per call")
+    suite.add_argument("--cache", choices=["cold", "warm"], default="cold",
+                       help="cold disables the vision and recommendation caches for the /analyze runs")
+    suite.add_argument("--out", help="write JSON results here")
+    suite.add_argument("--baseline", help="compare against this earlier suite result")
+    suite.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown")
+    suite.add_argument("--startup-runs", type=int, default=3, help="fresh processes timed for startup")
+    suite.add_argument("--startup-budget-ms", type=float, default=1000,
+                       help="most a fresh process may take from `import backend` to its first /health")
+
+    frm = sub.add_parser("frames", help="latency and memory of /analyze/frames against clip length")
+    frm.add_argument("--seconds", type=int, nargs="+", default=[2, 8, 30], help="clip lengths to post")
+
+    start = sub.add_parser("startup", help="import, create_app() and first /health time of a fresh process")
+    start.add_argument("--runs", type=int, default=5)
+    start.add_argument("--budget-ms", type=float, default=1000)
+
+    det = sub.add_parser("detectors", help="recall and latency of each installed face detector engine")
+    det.add_argument("--sizes", type=int, nargs="+", default=[640, 1600, 4000],
+                     help="long side of the generated photos; detectors see their analysis thumbnail")
+    det.add_argument("--repeat", type=int, default=5)
+
+    comp = sub.add_parser("compare", help="diff two suite result files")
+    comp.add_argument("baseline")
+    comp.add_argument("current")
+    comp.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown")
+
+    args = parser.parse_args(argv)
+    if args.command == "resolution":
+        bench_resolution(args.sizes, args.analysis_sides, args.repeat)
+    elif args.command == "detectors":
+        bench_detectors(args.sizes, args.repeat)
+    elif args.command == "frames":
+        bench_frames(args.seconds)
+    elif args.command == "startup":
+        startup = bench_startup(args.runs, args.budget_ms)
+        print_startup(startup)
+        return 0 if startup[0]["within_budget"] else 1
+    elif args.command == "suite":
+        return bench_suite(args)
+    elif args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        return 1 if compare_results(baseline, current, args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def image_key(data):
+    """Content address for an upload: the same bytes always map to the same key."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def profile_key(skin_label, gender, age_group):
+    """Normalized key for a recommendation prompt profile."""
+    return f"{skin_label.strip().lower()}|{gender.strip().lower()}|{age_group.strip().lower()}"
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """
+    On-disk cache tier that survives restarts.
+    Values must be JSON-serializable; expired rows are ignored on read and
+    pruned on write.
+    """
+
+    def __init__(self, path, table, ttl=86400):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self._connect()
+        with self._conn:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+        # a SQLite connection must not cross fork(); pre-fork server workers
+        # each open their own
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._connect)
+
+    def _connect(self):
+        # fresh lock too: a forked child may inherit this one held
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl),
+            )
+            self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+class TieredCache:
+    """
+    Memory tier in front of an optional disk tier, with hit/miss counters.
+    - get() checks memory, then disk (promoting disk hits into memory)
+    - peek() is the same lookup without touching the counters, for re-checks
+      of a key whose miss was already counted
+    - set() writes through to both tiers
+    """
+
+    def __init__(self, name, memory, disk=None):
+        self.name = name
+        self.memory = memory
+        self.disk = disk
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value, counter = self._lookup(key)
+        self._count(counter)
+        return value
+
+    def peek(self, key):
+        return self._lookup(key)[0]
+
+    def _lookup(self, key):
+        """(value, counter to bump) for `key`; value is None on a miss."""
+        value = self.memory.get(key)
+        if value is not None:
+            return value, "memory_hits"
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+                return value, "disk_hits"
+        return None, "misses"
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "disk_entries": len(self.disk) if self.disk is not None else None,
+        }
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self, timeout=None):
+        """The leader's result; raises its exception, or TimeoutError when it takes more than `timeout` seconds."""
+        if not self.done.wait(timeout):
+            raise TimeoutError(f"shared call still running after {timeout}s")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Collapses concurrent work for the same key into a single call.
+    - do(key, fn, timeout): the first caller (the leader) runs fn; callers
+      arriving before it returns wait for it and get the same result or
+      exception, or TimeoutError after `timeout` seconds
+    - join()/finish() are the same protocol by hand, for leaders that
+      produce their result incrementally
+    `coalesced` counts the callers that were served without a call of their own.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """Return (flight, is_leader); a leader must always call finish()."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            self.calls += 1
+            return flight, True
+
+    def finish(self, key, flight, result=None, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.result = result
+        flight.error = error
+        flight.done.set()
+
+    def do(self, key, fn, timeout=None):
+        flight, leader = self.join(key)
+        if not leader:
+            return flight.wait(timeout)
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result=result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._flights)}
+
+
+def make_cache(name, maxsize, ttl, db_path=None):
+    """Build a TieredCache; the disk tier is only added when `db_path` is set."""
+    disk = SQLiteCache(db_path, name, ttl) if db_path else None
+    return TieredCache(name, LRUCache(maxsize, ttl), disk)
@@ -0,0 +1,166 @@
+"""
+Product and shopping-link catalog, loaded once from catalog.json.
+
+At load time every product is expanded into an index keyed by
+(gender, age_group, skin family, retailer), each bucket sorted by rank, and
+every search URL is encoded. The `shopping_links`, `amazon_link` and
+`products` fields of /analyze are then prebuilt for each profile, so a
+request costs one dict lookup however many retailers and products the file
+holds.
+
+Keys in catalog.json:
+- retailers: name -> search_url (with a `{query}` placeholder, or none for
+  a plain landing page) and the separator put between query words
+- skin_families: family -> skin-tone labels; labels not listed fall into
+  "other". Fragments are prebuilt for the listed labels.
+- shopping_links: retailers to link and the query template for them
+- featured / featured_default: the single `amazon_link` per gender and age
+- products: name, img, query, gender and retailer, plus optional age and
+  skin lists (omitted means every value) and rank (lower first)
+- product_retailers / products_per_response: what goes into `products`
+"""
+import json
+import os
+from urllib.parse import quote
+
+from prompts import AGE_ALIASES, AGE_GROUPS, GENDERS
+
+CATALOG_PATH = os.getenv(
+    "CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.json"))
+# skin-tone labels that are not in any family
+OTHER_FAMILY = "other"
+# index slot for age groups outside AGE_GROUPS; holds products listed for every age
+ANY_AGE = "*"
+
+
+class FrozenDict(dict):
+    """A dict that refuses changes, so shared prebuilt fragments cannot be edited by one request."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("catalog fragments are read-only")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+class Retailer:
+    def __init__(self, name, search_url, separator="+"):
+        self.name = name
+        self.search_url = search_url
+        self.separator = separator
+
+    def url(self, query):
+        if "{query}" not in self.search_url:
+            return self.search_url
+        words = (quote(word, safe="") for word in query.split())
+        return self.search_url.replace("{query}", self.separator.join(words))
+
+
+class Catalog:
+    """
+    Indexed products and prebuilt response fragments.
+    - fragment(gender, age_group, skin_label): the link fields of /analyze
+    - products(...): ranked products for any retailers, straight from the index
+    - skin_family(label): which product family a skin-tone label belongs to
+    """
+
+    def __init__(self, data):
+        self.version = data.get("version")
+        self.retailers = {name: Retailer(name, **spec) for name, spec in data["retailers"].items()}
+        self._families = {label: family for family, labels in data.get("skin_families", {}).items()
+                          for label in labels}
+        families = sorted(set(self._families.values()) | {OTHER_FAMILY})
+
+        self._index = {}
+        for product in data.get("products", []):
+            entry = FrozenDict({
+                "name": product["name"],
+                "img": product.get("img", "🛍️"),
+                "url": self._retailer(product["retailer"]).url(product["query"]),
+            })
+            rank = product.get("rank", 0)
+            for age in product.get("age", AGE_GROUPS + (ANY_AGE,)):
+                for family in product.get("skin", families):
+                    key = (product["gender"], age, family, product["retailer"])
+                    self._index.setdefault(key, []).append((rank, entry))
+        # stable sort: equal ranks keep their order in the file
+        self._index = {key: tuple(entry for _, entry in sorted(entries, key=lambda item: item[0]))
+                       for key, entries in self._index.items()}
+
+        featured = data["featured_default"]
+        self._featured_default = FrozenDict({
+            "name": featured["name"], "url": self._retailer(featured["retailer"]).url(featured["query"])})
+        self._featured = {
+            (item["gender"], item["age"]): FrozenDict({
+                "name": item["name"], "url": self._retailer(item["retailer"]).url(item["query"])})
+            for item in data.get("featured", [])
+        }
+
+        links = data.get("shopping_links", {})
+        self._link_retailers = tuple(self._retailer(name) for name in links.get("retailers", ()))
+        self._link_query = links.get("query", "{gender} {skin_label} fashion")
+        self._product_retailers = tuple(data.get("product_retailers", self.retailers))
+        self._products_per_response = data.get("products_per_response", 4)
+
+        self._fragments = {
+            (gender, age, skin): self._build_fragment(gender, age, skin)
+            for gender in GENDERS for age in AGE_GROUPS for skin in self._families
+        }
+
+    @classmethod
+    def load(cls, path=CATALOG_PATH):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def _retailer(self, name):
+        try:
+            return self.retailers[name]
+        except KeyError:
+            raise ValueError(f"catalog refers to unknown retailer {name!r}") from None
+
+    def skin_family(self, skin_label):
+        return self._families.get(skin_label, OTHER_FAMILY)
+
+    def products(self, gender, age_group, skin_label, retailers=None, limit=None):
+        """Products for a profile, best rank first, from each retailer in turn."""
+        age_group = AGE_ALIASES.get(age_group, age_group)
+        if age_group not in AGE_GROUPS:
+            age_group = ANY_AGE
+        family = self.skin_family(skin_label)
+        found = ()
+        for retailer in self._product_retailers if retailers is None else retailers:
+            found += self._index.get((gender, age_group, family, retailer), ())
+        return found if limit is None else found[:limit]
+
+    def shopping_links(self, gender, skin_label):
+        query = self._link_query.format(gender=gender, skin_label=skin_label)
+        return FrozenDict({retailer.name: retailer.url(query) for retailer in self._link_retailers})
+
+    def featured(self, gender, age_group):
+        return self._featured.get((gender, AGE_ALIASES.get(age_group, age_group)), self._featured_default)
+
+    def _build_fragment(self, gender, age_group, skin_label):
+        return FrozenDict({
+            "shopping_links": self.shopping_links(gender, skin_label),
+            "amazon_link": self.featured(gender, age_group),
+            "products": self.products(gender, age_group, skin_label, limit=self._products_per_response),
+        })
+
+    def fragment(self, gender, age_group, skin_label):
+        """`shopping_links`, `amazon_link` and `products` for a profile; shared, so read-only."""
+        fragment = self._fragments.get((gender, AGE_ALIASES.get(age_group, age_group), skin_label))
+        if fragment is None:
+            # a profile outside the known labels; built on the spot rather than stored
+            fragment = self._build_fragment(gender, age_group, skin_label)
+        return fragment
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "retailers": len(self.retailers),
+            "index_keys": len(self._index),
+            "fragments": len(self._fragments),
+        }
@@ -0,0 +1,262 @@
+"""
+Face detector engines behind one interface.
+
+Every engine takes the grayscale analysis thumbnail (frame.small_gray) and
+returns face boxes (x, y, w, h) in its coordinates:
+- haar: OpenCV's frontal Haar cascade (ships with opencv-python)
+- lbp: the "improved" LBP frontal cascade, faster than Haar
+- yunet: OpenCV's YuNet CNN through cv2.FaceDetectorYN, also finds turned
+  and tilted faces
+- ssd: the res10 300x300 SSD through cv2.dnn
+All run on the CPU from local files in MODEL_DIR; `flask --app backend fetch-models`
+downloads the ones that do not ship with OpenCV. The CNN engines see the
+thumbnail as 3-channel gray, so a lazily decoded JPEG still only needs its
+full pixels once a face was found.
+
+FACE_DETECTOR picks the engine. "auto" times every engine whose files are
+present on the bundled sample photos (sample_male.jpg, also turned,
+mirrored, halved and darkened, plus the faceless styleimge.jpeg) and keeps
+the fastest one that finds at least FACE_DETECTOR_MIN_RECALL of the faces
+without a false positive.
+"""
+import os
+import statistics
+import time
+
+import cv2
+import numpy as np
+
+FACE_DETECTOR = os.getenv("FACE_DETECTOR", "haar")
+FACE_DETECTOR_MIN_RECALL = float(os.getenv("FACE_DETECTOR_MIN_RECALL", "0.75"))
+# smallest face side reported by any engine, in thumbnail pixels
+MIN_FACE_SIDE = 30
+# bundled photos "auto" scores engines on: the face box in sample_male.jpg
+# (x, y, w, h), and styleimge.jpeg, silhouettes where no face should be found
+SAMPLE_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_FACE = (os.path.join(SAMPLE_DIR, "sample_male.jpg"), (218, 202, 172, 172))
+SAMPLE_NO_FACE = os.path.join(SAMPLE_DIR, "styleimge.jpeg")
+# the face photo is also scored turned, mirrored, smaller and underexposed,
+# the selfies the frontal cascades tend to miss
+SAMPLE_ROTATIONS = (-30, -15, 15, 30)
+
+
+class FaceDetector:
+    """
+    Base class for an engine. Subclasses list their model files in `files`
+    (name in MODEL_DIR -> download URL, or an absolute path with URL None)
+    and build themselves from the file contents read once by read_files().
+    An instance keeps per-call state, so it is owned by one thread at a time.
+    """
+    name = None
+    files = {}
+
+    @classmethod
+    def paths(cls, model_dir):
+        return [os.path.join(model_dir, name) for name in cls.files]
+
+    @classmethod
+    def available(cls, model_dir):
+        return all(os.path.exists(path) for path in cls.paths(model_dir))
+
+    @classmethod
+    def read_files(cls, model_dir):
+        """Contents of the engine's model files as uint8 arrays, in `files` order."""
+        return [np.fromfile(path, dtype=np.uint8) for path in cls.paths(model_dir)]
+
+    def detect(self, gray):
+        raise NotImplementedError
+
+    def warm_up(self):
+        self.detect(np.zeros((64, 64), dtype=np.uint8))
+
+
+class CascadeDetector(FaceDetector):
+    def __init__(self, blobs):
+        fs = cv2.FileStorage(blobs[0].tobytes().decode(), cv2.FILE_STORAGE_READ | cv2.FILE_STORAGE_MEMORY)
+        self.cascade = cv2.CascadeClassifier()
+        if not self.cascade.read(fs.getFirstTopLevelNode()):
+            raise RuntimeError(f"could not parse the {self.name} face cascade")
+
+    def detect(self, gray):
+        faces = self.cascade.detectMultiScale(
+            gray, scaleFactor=1.1, minNeighbors=5, minSize=(MIN_FACE_SIDE, MIN_FACE_SIDE))
+        return [tuple(int(v) for v in face) for face in faces]
+
+
+class HaarDetector(CascadeDetector):
+    name = "haar"
+    files = {cv2.data.haarcascades + "haarcascade_frontalface_default.xml": None}
+
+
+class LBPDetector(CascadeDetector):
+    name = "lbp"
+    files = {
+        "lbpcascade_frontalface_improved.xml":
+            "https://raw.githubusercontent.com/opencv/opencv/4.x/data/lbpcascades/lbpcascade_frontalface_improved.xml",
+    }
+
+
+class YuNetDetector(FaceDetector):
+    name = "yunet"
+    files = {
+        "face_detection_yunet_2023mar.onnx":
+            "https://github.com/opencv/opencv_zoo/raw/main/models/face_detection_yunet/face_detection_yunet_2023mar.onnx",
+    }
+    score_threshold = 0.8
+
+    def __init__(self, blobs):
+        self.net = cv2.FaceDetectorYN.create(
+            "onnx", blobs[0], np.zeros(0, dtype=np.uint8), (320, 320), self.score_threshold, 0.3, 50)
+
+    def detect(self, gray):
+        h, w = gray.shape[:2]
+        self.net.setInputSize((w, h))
+        _, faces = self.net.detect(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
+        if faces is None:
+            return []
+        return _clip_boxes(faces[:, :4], w, h)
+
+
+class SSDDetector(FaceDetector):
+    name = "ssd"
+    files = {
+        "deploy.prototxt":
+            "https://raw.githubusercontent.com/opencv/opencv/4.x/samples/dnn/face_detector/deploy.prototxt",
+        "res10_300x300_ssd_iter_140000_fp16.caffemodel":
+            "https://raw.githubusercontent.com/opencv/opencv_3rdparty/dnn_samples_face_detector_20180205_fp16/"
+            "res10_300x300_ssd_iter_140000_fp16.caffemodel",
+    }
+    confidence = 0.5
+    # per-channel mean the network was trained with (BGR)
+    mean = (104.0, 177.0, 123.0)
+
+    def __init__(self, blobs):
+        self.net = cv2.dnn.readNetFromCaffe(blobs[0], blobs[1])
+
+    def detect(self, gray):
+        h, w = gray.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), 1.0, (300, 300), self.mean)
+        self.net.setInput(blob)
+        # rows of (image, class, confidence, x1, y1, x2, y2), corners relative to the input
+        rows = self.net.forward()[0, 0]
+        rows = rows[rows[:, 2] >= self.confidence]
+        corners = rows[:, 3:7] * np.array([w, h, w, h], dtype=np.float32)
+        return _clip_boxes(np.column_stack([corners[:, :2], corners[:, 2:] - corners[:, :2]]), w, h)
+
+
+def _clip_boxes(boxes, width, height):
+    """Float (x, y, w, h) rows -> int boxes inside the image, dropping ones under MIN_FACE_SIDE."""
+    result = []
+    for x, y, w, h in boxes:
+        x0, y0 = max(0, int(x)), max(0, int(y))
+        x1, y1 = min(width, int(x + w)), min(height, int(y + h))
+        if x1 - x0 >= MIN_FACE_SIDE and y1 - y0 >= MIN_FACE_SIDE:
+            result.append((x0, y0, x1 - x0, y1 - y0))
+    return result
+
+
+ENGINES = {engine.name: engine for engine in (HaarDetector, LBPDetector, YuNetDetector, SSDDetector)}
+if FACE_DETECTOR != "auto" and FACE_DETECTOR not in ENGINES:
+    raise ValueError(f"unknown FACE_DETECTOR {FACE_DETECTOR!r}; choose from {sorted(ENGINES)} or 'auto'")
+
+
+def _thumbnail(bgr):
+    from image_frame import open_image
+
+    ok, buf = cv2.imencode(".jpg", bgr, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    return open_image(buf.tobytes()).small_gray
+
+
+def sample_set():
+    """
+    (thumbnail, expected face box or None) pairs built from the bundled
+    photos, as the request path would hand them to a detector.
+    """
+    path, (x, y, w, h) = SAMPLE_FACE
+    image = cv2.imread(path)
+    height, width = image.shape[:2]
+    cx, cy = x + w / 2, y + h / 2
+    samples = [(image, (x, y, w, h)), (cv2.flip(image, 1), (width - x - w, y, w, h))]
+    for angle in SAMPLE_ROTATIONS:
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        turned = cv2.warpAffine(image, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE)
+        rx, ry = matrix @ np.array([cx, cy, 1.0])
+        samples.append((turned, (int(rx - w / 2), int(ry - h / 2), w, h)))
+    half = cv2.resize(image, (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+    samples.append((half, (x // 2, y // 2, w // 2, h // 2)))
+    samples.append((cv2.convertScaleAbs(image, alpha=0.45), (x, y, w, h)))
+    samples.append((cv2.imread(SAMPLE_NO_FACE), None))
+
+    result = []
+    for bgr, box in samples:
+        gray = _thumbnail(bgr)
+        scale = gray.shape[1] / bgr.shape[1]
+        result.append((gray, None if box is None else tuple(round(v * scale) for v in box)))
+    return result
+
+
+def _matches(found, expected):
+    """A detection counts when it covers the expected face's centre at roughly its size."""
+    ex, ey, ew, eh = expected
+    cx, cy = ex + ew / 2, ey + eh / 2
+    return any(x <= cx <= x + w and y <= cy <= y + h and 0.5 <= w / ew <= 2 for x, y, w, h in found)
+
+
+def measure(detector, samples, repeat=3):
+    """
+    Score a built detector on sample_set() output. Returns (recall on the
+    face photos, false positives on the no-face photos, median ms per image).
+    """
+    hits = faces = false_positives = 0
+    for gray, expected in samples:
+        found = detector.detect(gray)
+        if expected is None:
+            false_positives += len(found)
+        else:
+            faces += 1
+            hits += _matches(found, expected)
+    timings = []
+    for _ in range(repeat):
+        for gray, _ in samples:
+            start = time.perf_counter()
+            detector.detect(gray)
+            timings.append((time.perf_counter() - start) * 1000)
+    return hits / max(1, faces), false_positives, statistics.median(timings)
+
+
+def score_engines(model_dir, samples=None):
+    """(name, recall, false positives, median ms) for every engine whose files are present."""
+    samples = sample_set() if samples is None else samples
+    scores = []
+    for name, engine in ENGINES.items():
+        if not engine.available(model_dir):
+            continue
+        try:
+            detector = engine(engine.read_files(model_dir))
+        except (cv2.error, RuntimeError) as e:
+            print(f"face detector {name}: could not load ({e})")
+            continue
+        detector.warm_up()
+        scores.append((name, *measure(detector, samples)))
+    return scores
+
+
+def pick_engine(scores, min_recall=FACE_DETECTOR_MIN_RECALL):
+    """
+    The fastest engine that reaches `min_recall` without a false positive;
+    failing that, the one with the best recall.
+    """
+    if not scores:
+        return HaarDetector.name
+    passing = [s for s in scores if s[1] >= min_recall and s[2] == 0]
+    if passing:
+        return min(passing, key=lambda s: s[3])[0]
+    return max(scores, key=lambda s: (s[1], -s[2], -s[3]))[0]
+
+
+def choose_engine(model_dir, min_recall=FACE_DETECTOR_MIN_RECALL):
+    """Engine name for FACE_DETECTOR=auto, scored on the sample photos at startup."""
+    scores = score_engines(model_dir)
+    for name, recall, false_positives, ms in scores:
+        print(f"face detector {name}: recall {recall:.2f}, {false_positives} false positives, {ms:.1f} ms per image")
+    return pick_engine(scores, min_recall)
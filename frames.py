@@ -0,0 +1,169 @@
+"""
+Multi-frame analysis: pick from a webcam burst or a short clip.
+
+A single blurry selfie costs the user a whole round trip; a burst of photos
+or a couple of seconds of video almost always holds a usable frame. Frames
+are decoded and scored one at a time, cheapest check first:
+- sharpness: Laplacian variance of the analysis thumbnail (vision.sharpness)
+- face presence: the face detector on the same thumbnail, only for frames
+  that are sharp enough
+Frames that pass both give a skin-tone sample from the face. Scanning stops
+once `good_enough` frames reached `sharp_enough`. Only the best frame so far
+is kept, so memory does not grow with the clip length. The gender check
+then runs once, on the sharpest frame with a face, and the skin tone is the
+median over every accepted frame (skin_tone.aggregate_skin_tones).
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import islice
+
+import cv2
+
+from image_frame import ImageFrame, open_image
+from metrics import span
+from models import registry as model_registry
+from skin_tone import aggregate_skin_tones, detect_skin_tone
+from vision import BLUR_THRESHOLD, estimate_gender, find_face, sharpness
+
+# stop scanning once this many frames with a face reached FRAMES_SHARP_ENOUGH
+FRAMES_GOOD_ENOUGH = int(os.getenv("FRAMES_GOOD_ENOUGH", "3"))
+FRAMES_SHARP_ENOUGH = float(os.getenv("FRAMES_SHARP_ENOUGH", str(2 * BLUR_THRESHOLD)))
+# clips are sampled at about this many frames per second; neighbouring
+# video frames are near duplicates
+FRAMES_SAMPLE_FPS = float(os.getenv("FRAMES_SAMPLE_FPS", "6"))
+
+
+@dataclass
+class FrameSelection:
+    """
+    Result of select_frames().
+    - scanned, blurry, no_face, unreadable, accepted: frame counts; accepted
+      frames were sharp and had a face, unreadable ones had a sharp face on
+      the thumbnail but their full pixels did not decode
+    - stopped_early: the scan ended on enough good frames, not on the input
+    - best_index: index of the frame the gender check ran on (None if no frame was accepted)
+    - detected_gender, confidence: from that frame
+    - skin_tone: SkinTone aggregated over the accepted frames
+    """
+    scanned: int = 0
+    blurry: int = 0
+    no_face: int = 0
+    unreadable: int = 0
+    accepted: int = 0
+    stopped_early: bool = False
+    best_index: int = None
+    detected_gender: str = None
+    confidence: float = None
+    skin_tone: object = None
+
+    def to_dict(self):
+        return {
+            "scanned": self.scanned,
+            "blurry": self.blurry,
+            "no_face": self.no_face,
+            "unreadable": self.unreadable,
+            "accepted": self.accepted,
+            "stopped_early": self.stopped_early,
+            "best_index": self.best_index,
+        }
+
+
+def iter_image_frames(uploads):
+    """(index, ImageFrame) for each decodable photo of a burst; JPEGs open from their thumbnail."""
+    for index, data in enumerate(uploads):
+        frame = open_image(data)
+        if frame is not None:
+            yield index, frame
+
+
+@contextmanager
+def clip_file(data, suffix=".mp4"):
+    """Write an uploaded clip to a temporary file for cv2.VideoCapture; removed on exit."""
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def clip_size(path):
+    """(width, height) of a clip OpenCV can decode, or None."""
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            return None
+        return int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+
+
+def iter_video_frames(path, sample_fps=FRAMES_SAMPLE_FPS):
+    """
+    (index, ImageFrame) for about `sample_fps` frames per second of a clip,
+    decoded one at a time. Frames in between are grabbed but not converted.
+    """
+    cap = cv2.VideoCapture(path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        stride = max(1, round(fps / sample_fps)) if fps > 0 and sample_fps > 0 else 1
+        index = 0
+        while cap.grab():
+            if index % stride == 0:
+                ok, bgr = cap.retrieve()
+                if ok:
+                    yield index, ImageFrame(bgr)
+            index += 1
+    finally:
+        cap.release()
+
+
+def select_frames(frames, max_frames=None, good_enough=FRAMES_GOOD_ENOUGH, sharp_enough=FRAMES_SHARP_ENOUGH):
+    """
+    Score (index, ImageFrame) pairs as they arrive and pick the best one.
+    At most `max_frames` are scanned. Returns a FrameSelection; when no frame
+    was accepted its gender and skin tone are None.
+    """
+    selection = FrameSelection()
+    tones = []
+    best = None  # (sharpness, index, frame, face box in frame.bgr coordinates)
+    good = 0
+    # one model set for the whole scan, as for a single photo
+    with model_registry.acquire() as models:
+        for index, frame in islice(frames, max_frames):
+            selection.scanned += 1
+            with span("frame_score"):
+                score = sharpness(frame)
+                box = find_face(frame, models) if score >= BLUR_THRESHOLD else None
+            if score < BLUR_THRESHOLD:
+                selection.blurry += 1
+                continue
+            if box is None:
+                selection.no_face += 1
+                continue
+            try:
+                # on a frame from open_image() this is where the full pixels get decoded
+                box = frame.to_full(box)
+            except ValueError:
+                # the thumbnail decoded but the full image did not (truncated upload)
+                selection.unreadable += 1
+                continue
+            selection.accepted += 1
+            with span("skin_tone"):
+                tones.append(detect_skin_tone(frame, box))
+            if best is None or score > best[0]:
+                best = (score, index, frame, box)
+            good += score >= sharp_enough
+            if good >= good_enough:
+                selection.stopped_early = True
+                break
+
+        if best is not None:
+            _, selection.best_index, frame, box = best
+            with span("gender"):
+                selection.detected_gender, selection.confidence = estimate_gender(frame, box, models)
+    selection.skin_tone = aggregate_skin_tones(tones)
+    return selection
@@ -0,0 +1,229 @@
+import os
+from functools import cached_property
+
+import cv2
+import numpy as np
+
+from metrics import span
+
+# long side of the copy used for the cheap whole-image passes (blur check,
+# face detection); 0 disables downscaling
+ANALYSIS_MAX_SIDE = int(os.getenv("ANALYSIS_MAX_SIDE", "640"))
+# big photos are decoded at a reduced JPEG scale as long as the result keeps
+# at least this long side, which is plenty for face crops
+DETAIL_MAX_SIDE = int(os.getenv("DETAIL_MAX_SIDE", "1600"))
+
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+_REDUCED_GRAY_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4), (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+)
+# JPEG start-of-frame markers carry the image size; C4, C8 and CC are not SOFs
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class ImageFrame:
+    """
+    A decoded upload shared by every analyzer in a single request.
+    - the BGR pixels are decoded exactly once
+    - grayscale and RGB views are computed on first use and then reused
+    - `small` is a copy no longer than `analysis_max_side` for whole-image
+      passes; boxes found on it map back to `bgr` with to_full()
+    - built by open_image() from a thumbnail, `small_gray` is that
+      thumbnail and `bgr` is only decoded from `data` on first use
+    """
+
+    def __init__(self, bgr, analysis_max_side=ANALYSIS_MAX_SIDE, data=None, detail_max_side=DETAIL_MAX_SIDE,
+                 small_gray=None):
+        if bgr is not None:
+            self.bgr = bgr
+        if small_gray is not None:
+            self.small_gray = small_gray
+        self.analysis_max_side = analysis_max_side
+        self._data = data
+        self._detail_max_side = detail_max_side
+
+    @cached_property
+    def bgr(self):
+        with span("decode"):
+            bgr = decode_bgr(np.frombuffer(self._data, dtype=np.uint8), self._detail_max_side)
+        if bgr is None:
+            raise ValueError("image thumbnail decoded but the full image did not")
+        self._data = None
+        return bgr
+
+    @property
+    def height(self):
+        return self.bgr.shape[0]
+
+    @property
+    def width(self):
+        return self.bgr.shape[1]
+
+    @cached_property
+    def gray(self):
+        return cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+
+    @cached_property
+    def rgb(self):
+        return cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB)
+
+    @cached_property
+    def scale(self):
+        """Factor from `small` coordinates back to `bgr` coordinates (>= 1)."""
+        long_side = max(self.height, self.width)
+        if "small_gray" in self.__dict__:
+            # the thumbnail was decoded separately; measure it rather than
+            # assuming it is exactly analysis_max_side long
+            return long_side / max(self.small_gray.shape)
+        if not self.analysis_max_side or long_side <= self.analysis_max_side:
+            return 1.0
+        return long_side / self.analysis_max_side
+
+    @cached_property
+    def small(self):
+        if self.scale == 1.0:
+            return self.bgr
+        size = (max(1, round(self.width / self.scale)), max(1, round(self.height / self.scale)))
+        return cv2.resize(self.bgr, size, interpolation=cv2.INTER_AREA)
+
+    @cached_property
+    def small_gray(self):
+        if self.scale == 1.0:
+            return self.gray
+        return cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY)
+
+    def to_full(self, box):
+        """Map an (x, y, w, h) box found on `small` to `bgr` pixel coordinates."""
+        if self.scale == 1.0:
+            return box
+        x, y, w, h = (int(round(v * self.scale)) for v in box)
+        x, y = min(x, self.width - 1), min(y, self.height - 1)
+        return x, y, min(w, self.width - x), min(h, self.height - y)
+
+
+def read_image_size(data):
+    """
+    Return (width, height) from a JPEG, PNG or WebP header without decoding
+    pixels, or None for other formats and truncated headers.
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24 and data[12:16] == b"IHDR":
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return _read_webp_size(data)
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # markers without a length
+            i += 2
+            continue
+        if marker == 0xD9:
+            return None
+        length = int.from_bytes(data[i + 2:i + 4], "big")
+        if marker in _JPEG_SOF:
+            if i + 9 > len(data):
+                return None
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + length
+    return None
+
+
+def _read_webp_size(data):
+    """(width, height) from the first chunk of a WebP file: VP8 (lossy), VP8L (lossless) or VP8X (extended)."""
+    if len(data) < 30:
+        return None
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        # 3-byte frame tag, start code, then 14-bit width and height
+        if data[23:26] != b"\x9d\x01\x2a":
+            return None
+        return (int.from_bytes(data[26:28], "little") & 0x3FFF,
+                int.from_bytes(data[28:30], "little") & 0x3FFF)
+    if chunk == b"VP8L":
+        # signature byte, then width - 1 and height - 1 as 14-bit fields
+        if data[20] != 0x2F:
+            return None
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        # 4 bytes of flags, then canvas width - 1 and height - 1 as 24-bit fields
+        return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    return None
+
+
+def decode_flag(size, detail_max_side=DETAIL_MAX_SIDE):
+    """Pick the cheapest imdecode mode that still keeps `detail_max_side` pixels on the long side."""
+    if size is None or not detail_max_side:
+        return cv2.IMREAD_COLOR
+    long_side = max(size)
+    for factor, flag in _REDUCED_FLAGS:
+        if long_side // factor >= detail_max_side:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_bgr(buf, detail_max_side=DETAIL_MAX_SIDE):
+    """Decode a uint8 buffer into a BGR array, reduced for very large photos; None if not an image."""
+    if buf.size == 0:
+        return None
+    flag = decode_flag(read_image_size(buf[:262144].tobytes()), detail_max_side)
+    return cv2.imdecode(buf, flag)
+
+
+def decode_image(data, analysis_max_side=ANALYSIS_MAX_SIDE, detail_max_side=DETAIL_MAX_SIDE):
+    """Decode raw upload bytes into an ImageFrame, or None if they are not an image."""
+    if not data:
+        return None
+    bgr = decode_bgr(np.frombuffer(data, dtype=np.uint8), detail_max_side)
+    if bgr is None:
+        return None
+    return ImageFrame(bgr, analysis_max_side)
+
+
+def decode_thumbnail(data, max_side=ANALYSIS_MAX_SIDE):
+    """
+    Grayscale copy of the image no longer than `max_side`, decoded at the
+    smallest JPEG scale that still covers it; None if not an image.
+    """
+    size = read_image_size(data[:262144])
+    flag = cv2.IMREAD_GRAYSCALE
+    if size is not None and max_side:
+        for factor, reduced in _REDUCED_GRAY_FLAGS:
+            if max(size) // factor >= max_side:
+                flag = reduced
+                break
+    gray = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    if gray is None:
+        return None
+    h, w = gray.shape
+    if max_side and max(h, w) > max_side:
+        factor = max_side / max(h, w)
+        gray = cv2.resize(gray, (max(1, round(w * factor)), max(1, round(h * factor))), interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def open_image(data, analysis_max_side=ANALYSIS_MAX_SIDE, detail_max_side=DETAIL_MAX_SIDE):
+    """
+    Like decode_image(), but a JPEG is opened from a grayscale thumbnail and
+    its full pixels are decoded only once an analyzer needs them, so uploads
+    rejected on the thumbnail (blurry, no face) never pay for a full decode.
+    Other formats have no cheap reduced decode and are decoded up front.
+    """
+    if not data:
+        return None
+    if data[:2] != b"\xff\xd8" or not analysis_max_side:
+        with span("decode"):
+            return decode_image(data, analysis_max_side, detail_max_side)
+    with span("thumbnail"):
+        thumb = decode_thumbnail(data, analysis_max_side)
+    if thumb is None:
+        return None
+    return ImageFrame(None, analysis_max_side, data=data, detail_max_side=detail_max_side, small_gray=thumb)
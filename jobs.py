@@ -0,0 +1,141 @@
+import contextvars
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+# queued + running jobs allowed before new submissions are refused
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "64"))
+# finished jobs are kept this many seconds for clients to poll
+JOB_TTL = int(os.getenv("JOB_TTL", "600"))
+
+# threads running CPU-bound vision work, and how many more calls may wait
+# for one before new requests are turned away
+VISION_WORKERS = int(os.getenv("VISION_WORKERS", str(min(4, os.cpu_count() or 1))))
+VISION_QUEUE_DEPTH = int(os.getenv("VISION_QUEUE_DEPTH", "16"))
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit and CPUExecutor.run when their limit is reached."""
+
+
+class JobQueue:
+    """
+    Bounded background worker pool for slow request stages.
+    - submit() returns a job id right away or raises QueueFull
+    - get() returns the job's public state: queued, running, done or error
+    Jobs run in the process that accepted them. With several server
+    processes (serve.py --workers N) a poll may reach another one, so each
+    state change is also written to `store` (a cache.SQLiteCache on a file
+    all processes share) and get() falls back to it. Without a store, job
+    ids are only known to their own process.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_pending=JOB_QUEUE_SIZE, ttl=JOB_TTL, store=None):
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._store = store
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            self._prune()
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"{self._pending} jobs already pending")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {"status": "queued", "finished_at": None}
+            self._pending += 1
+        self._publish(job_id, {"status": "queued"})
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status="running")
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self._finish(job_id, status="error", error=str(e))
+        else:
+            self._finish(job_id, status="done", result=result)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+            job = self._public(self._jobs[job_id])
+        self._publish(job_id, job)
+
+    def _finish(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields, finished_at=time.monotonic())
+            self._pending -= 1
+            job = self._public(self._jobs[job_id])
+        self._publish(job_id, job)
+
+    @staticmethod
+    def _public(job):
+        return {key: value for key, value in job.items() if key != "finished_at"}
+
+    def _publish(self, job_id, job):
+        if self._store is not None:
+            self._store.set(job_id, job)
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] is not None and job["finished_at"] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return self._public(job)
+        # accepted by another server process, or not at all
+        return self._store.get(job_id) if self._store is not None else None
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+
+class CPUExecutor:
+    """
+    Bounded thread pool for CPU-bound request work, with admission control.
+    - run() executes fn on a pool thread and waits for its result
+    - at most `workers` calls run at once and `max_queued` more may wait;
+      past that run() raises QueueFull at once rather than letting callers
+      pile up behind the CPU
+    The caller's context (Flask request, metrics spans) is carried over to
+    the pool thread.
+    """
+
+    def __init__(self, workers=VISION_WORKERS, max_queued=VISION_QUEUE_DEPTH):
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cpu")
+        self._admitted = 0
+        self._lock = threading.Lock()
+
+    def run(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._admitted >= self.workers + self.max_queued:
+                raise QueueFull(f"{self._admitted} CPU tasks already admitted")
+            self._admitted += 1
+        try:
+            ctx = contextvars.copy_context()
+            return self._executor.submit(ctx.run, fn, *args, **kwargs).result()
+        finally:
+            with self._lock:
+                self._admitted -= 1
+
+    def depth(self):
+        """Calls running or waiting right now."""
+        with self._lock:
+            return self._admitted
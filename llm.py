@@ -0,0 +1,456 @@
+"""
+Gateway between the app and the LLM upstream.
+- every call has a timeout (LLM_TIMEOUT) and waits for one of
+  LLM_MAX_IN_FLIGHT slots, so a slow upstream cannot hold every worker
+- 429s, 5xx, timeouts and connection errors are retried with exponential
+  backoff and jitter, honouring Retry-After
+- LLM_BREAKER_THRESHOLD failed calls in a row open a circuit breaker; for
+  LLM_BREAKER_COOLDOWN seconds calls fail fast with LLMUnavailable, then
+  one probe call decides whether it closes again
+- the upstream is a pluggable backend: "groq" (LLM_BASE_URL can point it at
+  any OpenAI-compatible server) or "stub" for tests and load tests
+
+A local stub server for load tests:
+
+    python llm.py stub-server --port 8001 --delay 0.5 --fail-rate 0.1
+    LLM_BASE_URL=http://127.0.0.1:8001 python backend.py
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from metrics import registry as metrics_registry, span
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq")
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.3-70b-versatile")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL") or None
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+# how long a call may wait for an in-flight slot before giving up
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF = float(os.getenv("LLM_BACKOFF", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+LLM_STUB_DELAY = float(os.getenv("LLM_STUB_DELAY", "0"))
+
+LLM_ERRORS = metrics_registry.counter(
+    "styleai_llm_errors_total", "Failed LLM call attempts, by kind.", ("error",))
+LLM_RETRIES = metrics_registry.counter(
+    "styleai_llm_retries_total", "LLM call attempts that were retried.")
+LLM_FALLBACKS = metrics_registry.counter(
+    "styleai_llm_fallbacks_total", "Templated recommendations sent instead of an LLM answer, by cause.", ("error",))
+
+
+class LLMError(Exception):
+    """
+    A failed upstream call.
+    - kind: short label for metrics ("rate_limited", "timeout", "http_401", ...)
+    - retryable: whether the same call may succeed if repeated
+    - retry_after: seconds the upstream asked us to wait, if it said
+    """
+
+    def __init__(self, message, kind="error", status=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.kind = kind
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class LLMUnavailable(LLMError):
+    """Raised without calling the upstream: breaker open or no free in-flight slot."""
+
+
+def _retry_after(response):
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _from_groq_error(e):
+    import groq
+    status = getattr(e, "status_code", None)
+    if isinstance(e, groq.APITimeoutError):
+        return LLMError(str(e), kind="timeout", retryable=True)
+    if isinstance(e, groq.APIConnectionError):
+        return LLMError(str(e), kind="connection", retryable=True)
+    retry_after = _retry_after(getattr(e, "response", None))
+    if status == 429:
+        return LLMError(str(e), kind="rate_limited", status=status, retryable=True, retry_after=retry_after)
+    if status is not None and status >= 500:
+        return LLMError(str(e), kind="server_error", status=status, retryable=True, retry_after=retry_after)
+    return LLMError(str(e), kind=f"http_{status}" if status else "api_error", status=status)
+
+
+class GroqBackend:
+    """
+    The Groq chat completions API, or any OpenAI-compatible server at
+    `base_url`. One shared client keeps a keep-alive connection pool sized
+    to the in-flight limit; the SDK's own retries are off because the
+    gateway does them.
+    """
+
+    def __init__(self, api_key=None, base_url=LLM_BASE_URL, timeout=LLM_TIMEOUT, max_connections=LLM_MAX_IN_FLIGHT):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        # built on first use: importing groq and httpx is a large share of
+        # startup, and a pool opened before a pre-fork server forks would
+        # have its sockets shared by every worker
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._connect()
+        return self._client
+
+    def _connect(self):
+        import groq
+        import httpx
+
+        # a missing key is an LLMError like any other upstream failure, so
+        # callers fall back instead of failing the request
+        api_key = self.api_key or os.getenv("GROQ_API_KEY")
+        if not api_key:
+            raise LLMError("GROQ_API_KEY is not set", kind="no_api_key")
+        try:
+            return groq.Groq(
+                api_key=api_key,
+                base_url=self.base_url,
+                timeout=self.timeout,
+                max_retries=0,
+                http_client=httpx.Client(
+                    timeout=self.timeout,
+                    limits=httpx.Limits(max_connections=self.max_connections,
+                                        max_keepalive_connections=self.max_connections),
+                ),
+            )
+        except groq.GroqError as e:
+            raise LLMError(f"could not create the Groq client: {e}", kind="client_error") from e
+
+    def complete(self, prompt, model, temperature):
+        import groq
+        try:
+            completion = self.client.chat.completions.create(
+                model=model, messages=[{"role": "user", "content": prompt}], temperature=temperature)
+        except groq.APIError as e:
+            raise _from_groq_error(e) from e
+        return completion.choices[0].message.content
+
+    def stream(self, prompt, model, temperature):
+        import groq
+        try:
+            response = self.client.chat.completions.create(
+                model=model, messages=[{"role": "user", "content": prompt}], temperature=temperature, stream=True)
+        except groq.APIError as e:
+            raise _from_groq_error(e) from e
+        return self._chunks(response)
+
+    @staticmethod
+    def _chunks(response):
+        import groq
+        try:
+            for chunk in response:
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    yield text
+        except groq.APIError as e:
+            raise _from_groq_error(e) from e
+
+
+class StubBackend:
+    """
+    In-process stand-in for the upstream: answers after `delay` seconds with
+    a canned text derived from the prompt. `fail_rate` of the calls raise a
+    retryable 503 instead, for exercising retries and the breaker.
+    """
+
+    def __init__(self, delay=LLM_STUB_DELAY, fail_rate=0.0, chunks=4):
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.chunks = chunks
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _answer(self, prompt):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise LLMError("stub upstream failure", kind="server_error", status=503, retryable=True)
+        return "stub recommendations for: " + " ".join(prompt.split())[:80]
+
+    def complete(self, prompt, model, temperature):
+        return self._answer(prompt)
+
+    def stream(self, prompt, model, temperature):
+        text = self._answer(prompt)
+        step = max(1, len(text) // self.chunks)
+        return iter([text[i:i + step] for i in range(0, len(text), step)])
+
+
+BACKENDS = {"groq": GroqBackend, "stub": StubBackend}
+
+
+def make_backend(name=LLM_BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f"unknown LLM_BACKEND {name!r}; choose from {sorted(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `threshold` consecutive failures; open -> half-open
+    after `cooldown` seconds, letting one probe call through; the probe's
+    outcome closes or re-opens it. A probe that ends without an outcome (the
+    client went away mid-stream) is handed back with release_probe(), so
+    the next call probes instead.
+    """
+
+    def __init__(self, threshold=LLM_BREAKER_THRESHOLD, cooldown=LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "half_open"
+                return True
+            # open, or half-open with the probe still out
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def release_probe(self):
+        with self._lock:
+            if self.state == "half_open":
+                # the cooldown has already run out, so the next allow() probes again
+                self.state = "open"
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.threshold:
+                if self.state != "open":
+                    print(f"LLM circuit breaker open after {self._failures} failures")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class LLMGateway:
+    """
+    What the app calls instead of an SDK client.
+    - complete(prompt) returns the full text
+    - stream(prompt) yields text chunks; retries only happen before the
+      first chunk, since a half-sent answer cannot be taken back
+    Both raise LLMError when the call fails for good, or LLMUnavailable
+    when it was not attempted.
+    """
+
+    def __init__(self, backend, model=LLM_MODEL, max_in_flight=LLM_MAX_IN_FLIGHT, queue_timeout=LLM_QUEUE_TIMEOUT,
+                 max_retries=LLM_MAX_RETRIES, backoff=LLM_BACKOFF, breaker=None):
+        self.backend = backend
+        self.model = model
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max(1, max_in_flight))
+
+    def _delay(self, attempt, error):
+        delay = min(LLM_BACKOFF_MAX, self.backoff * 2 ** attempt) + random.uniform(0, self.backoff)
+        if error.retry_after is not None:
+            delay = max(delay, min(error.retry_after, LLM_BACKOFF_MAX))
+        return delay
+
+    def _attempts(self, call):
+        """Run `call` with retries; the caller already holds a slot."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return call()
+            except LLMError as e:
+                LLM_ERRORS.inc(e.kind)
+                if not e.retryable or attempt == self.max_retries:
+                    raise
+                LLM_RETRIES.inc()
+                time.sleep(self._delay(attempt, e))
+
+    def _admit(self):
+        # slot first: once the breaker lets a half-open probe through, the
+        # probe must actually run
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            # not the upstream's fault, so it does not count against the breaker
+            raise LLMUnavailable("too many LLM calls in flight", kind="saturated")
+        if not self.breaker.allow():
+            self._slots.release()
+            raise LLMUnavailable("LLM circuit breaker is open", kind="breaker_open")
+
+    def complete(self, prompt, temperature=0.7):
+        self._admit()
+        try:
+            with span("llm"):
+                text = self._attempts(lambda: self.backend.complete(prompt, self.model, temperature))
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # interrupted, not failed: a half-open probe must not stay out forever
+            self.breaker.release_probe()
+            raise
+        finally:
+            self._slots.release()
+        self.breaker.record_success()
+        return text
+
+    def stream(self, prompt, temperature=0.7):
+        self._admit()
+        try:
+            # the span covers the whole stream, including time spent in the client
+            with span("llm"):
+                chunks = self._attempts(lambda: self.backend.stream(prompt, self.model, temperature))
+                try:
+                    for text in chunks:
+                        yield text
+                except LLMError as e:
+                    # failed part-way through; too late to retry
+                    LLM_ERRORS.inc(e.kind)
+                    raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # GeneratorExit when the client stops reading: no verdict on the
+            # upstream, but a half-open probe must not stay out forever
+            self.breaker.release_probe()
+            raise
+        finally:
+            self._slots.release()
+        self.breaker.record_success()
+
+    def state(self):
+        return self.breaker.state
+
+
+# colour guidance per skin-tone label for the templated fallback
+FALLBACK_PALETTES = {
+    "Fair": "jewel tones (emerald, sapphire, ruby), navy, soft pastels and cool greys; avoid washed-out beige",
+    "Light": "soft pastels, dusty rose, powder blue, camel and navy",
+    "Medium": "olive, teal, warm coral, mustard and crisp white",
+    "Tan": "earth tones, terracotta, rust, warm khaki and cream",
+    "Deep": "rich earth tones, cobalt, fuchsia, bright white and gold accents",
+}
+FALLBACK_OUTFITS = {
+    "Male": ("a tailored blazer over an oxford shirt with chinos",
+             "a well-fitted crew-neck tee, dark jeans and clean white sneakers",
+             "a short, neat cut or textured crop; keep facial hair trimmed",
+             "a leather watch, a simple belt and minimal jewellery"),
+    "Female": ("a structured blazer with tailored trousers or a midi dress",
+               "a relaxed knit with straight-leg jeans and ankle boots",
+               "a soft layered cut or sleek ponytail that frames the face",
+               "delicate jewellery, a structured bag and a silk scarf"),
+}
+
+
+def fallback_recommendations(skin_label, gender, age_group, age_desc="contemporary"):
+    """Templated styling advice used when the LLM is unavailable."""
+    formal, casual, hair, accessories = FALLBACK_OUTFITS.get(gender, FALLBACK_OUTFITS["Female"])
+    palette = FALLBACK_PALETTES.get(skin_label, "navy, white, grey and one accent colour you love")
+    return (
+        "Our AI stylist is busy right now, so here is a quick guide for your profile. "
+        "Try again shortly for fully personalized advice.\n\n"
+        f"1. Dress codes: for formal and business settings try {formal}; for casual days, {casual}.\n"
+        f"2. Outfits: lean towards {age_desc} pieces for the {age_group} age group.\n"
+        f"3. Hair and grooming: {hair}.\n"
+        f"4. Accessories: {accessories}.\n"
+        f"5. Colour palette for {skin_label.lower()} skin: {palette}.\n"
+        "6. Why it works: these colours complement your skin's undertone, and the classic cuts "
+        "flatter most builds while staying easy to mix and match."
+    )
+
+
+def _run_stub_server(host, port, delay, fail_rate):
+    """Minimal OpenAI-compatible chat completions server that mimics a slow, flaky upstream."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            time.sleep(delay)
+            if fail_rate and random.random() < fail_rate:
+                payload = json.dumps({"error": {"message": "stub overloaded"}}).encode()
+                self.send_response(503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            prompt = body.get("messages", [{}])[-1].get("content", "")
+            text = "stub recommendations for: " + " ".join(prompt.split())[:80]
+            base = {"id": "stub", "created": int(time.time()), "model": body.get("model", "stub")}
+            if body.get("stream"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for word in text.split(" "):
+                    chunk = {**base, "object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+                return
+            payload = json.dumps({**base, "object": "chat.completion", "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    print(f"LLM stub server on http://{host}:{port} (delay {delay}s, fail rate {fail_rate})")
+    ThreadingHTTPServer((host, port), Handler).serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LLM gateway tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    stub = sub.add_parser("stub-server", help="run a local OpenAI-compatible stub upstream")
+    stub.add_argument("--host", default="127.0.0.1")
+    stub.add_argument("--port", type=int, default=8001)
+    stub.add_argument("--delay", type=float, default=0.5, help="seconds before each answer")
+    stub.add_argument("--fail-rate", type=float, default=0.0, help="fraction of calls answered with a 503")
+    args = parser.parse_args(argv)
+    if args.command == "stub-server":
+        _run_stub_server(args.host, args.port, args.delay, args.fail_rate)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
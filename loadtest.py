@@ -0,0 +1,171 @@
+"""
+Concurrency stress test for the /analyze endpoint.
+
+Fires hundreds of parallel uploads at the Flask app through its test client
+and checks that every response describes its own input image. Each upload is
+a slightly tinted copy of sample_male.jpg, so every request has a distinct
+skin-tone reading; a response carrying another request's reading means two
+requests shared state.
+
+It then sends one upload per validation stage that must fail it (size,
+content_type and dimensions in validation.py) through /analyze, as a
+/analyze/batch image and as a zip member, and checks each comes back with
+that stage's Rejection code before anything was decoded.
+
+The LLM backend is replaced by the in-process stub, so no API key or network is needed:
+
+    python loadtest.py --requests 300 --workers 32
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("GROQ_API_KEY", "loadtest")
+# this checks request isolation, not admission control: let every upload in
+os.environ.setdefault("VISION_QUEUE_DEPTH", "100000")
+
+import cv2
+import numpy as np
+
+import backend
+import validation
+from llm import StubBackend
+from image_frame import open_image
+from skin_tone import detect_skin_tone
+from vision import analyze_face
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample_male.jpg")
+
+
+def make_variant(base, i):
+    """Return JPEG bytes of `base` tinted by an offset unique to request `i`."""
+    offset = np.array([(i % 20) * 3, (i // 20 % 20) * 3, 0], dtype=np.int16)
+    tinted = np.clip(base.astype(np.int16) + offset, 0, 255).astype(np.uint8)
+    ok, buf = cv2.imencode(".jpg", tinted, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    if not ok:
+        raise RuntimeError("could not encode test image")
+    return buf.tobytes()
+
+
+def expected_result(data):
+    """Run the analyzers directly on `data` to get the answer /analyze must give."""
+    frame = open_image(data)
+    face_box, detected_gender, _ = analyze_face(frame)
+    return detected_gender, str(detect_skin_tone(frame, face_box))
+
+
+def png_header(width, height):
+    """The first bytes of a PNG claiming `width` x `height`; enough for the dimensions stage."""
+    return (b"\x89PNG\r\n\x1a\n" + (13).to_bytes(4, "big") + b"IHDR"
+            + width.to_bytes(4, "big") + height.to_bytes(4, "big") + b"\x08\x02\x00\x00\x00")
+
+
+def stage_failures():
+    """(name, bytes, expected Rejection code) for uploads that each fail one validation stage."""
+    ok, tiny = cv2.imencode(".png", np.zeros((validation.MIN_IMAGE_SIDE // 2,) * 2 + (3,), dtype=np.uint8))
+    return [
+        ("too_large.jpg", b"\xff\xd8\xff" + bytes(validation.MAX_UPLOAD_BYTES), validation.TOO_LARGE.code),
+        ("text.jpg", b"this is not an image", validation.UNSUPPORTED_TYPE.code),
+        ("tiny.png", tiny.tobytes(), validation.TOO_SMALL.code),
+        ("huge.png", png_header(12000, 12000), validation.TOO_MANY_PIXELS.code),
+    ]
+
+
+def check_validation_stages(app):
+    """Send every stage_failures() upload through each entry point; returns a list of mismatches."""
+    cases = stage_failures()
+    mismatches = []
+    with app.test_client() as client:
+        for name, data, code in cases:
+            resp = client.post("/analyze", data={"gender": "Male", "image": (io.BytesIO(data), name)},
+                               content_type="multipart/form-data")
+            if resp.get_json().get("code") != code:
+                mismatches.append(f"/analyze {name}: expected {code}, got {resp.get_json()}")
+
+        resp = client.post("/analyze/batch", data={"images": [(io.BytesIO(data), name) for name, data, _ in cases]},
+                           content_type="multipart/form-data")
+        got = [json.loads(line)["status"] for line in resp.get_data(as_text=True).splitlines()]
+        for (name, _, code), status in zip(cases, got):
+            if status != code:
+                mismatches.append(f"/analyze/batch image {name}: expected {code}, got {status}")
+
+        # an oversized member turns the whole archive away before any member is read
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name, data, _ in cases:
+                zf.writestr(name, data)
+        resp = client.post("/analyze/batch", data={"archive": (io.BytesIO(archive.getvalue()), "stages.zip")},
+                           content_type="multipart/form-data")
+        if resp.get_json().get("code") != validation.MEMBER_TOO_LARGE.code:
+            mismatches.append(f"/analyze/batch oversized member: expected 413, got {resp.get_json()}")
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zf:
+            for name, data, _ in cases[1:]:
+                zf.writestr(name, data)
+        resp = client.post("/analyze/batch", data={"archive": (io.BytesIO(archive.getvalue()), "stages.zip")},
+                           content_type="multipart/form-data")
+        got = [json.loads(line)["status"] for line in resp.get_data(as_text=True).splitlines()]
+        for (name, _, code), status in zip(cases[1:], got):
+            if status != code:
+                mismatches.append(f"/analyze/batch zip member {name}: expected {code}, got {status}")
+    return mismatches
+
+
+def run(n_requests, n_workers):
+    base = cv2.imread(SAMPLE_IMAGE)
+    if base is None:
+        raise SystemExit(f"could not read {SAMPLE_IMAGE}")
+
+    uploads = [make_variant(base, i) for i in range(n_requests)]
+    expected = [expected_result(data) for data in uploads]
+    if any(gender is None for gender, _ in expected):
+        raise SystemExit("sample image variants must all contain a detectable face")
+
+    app = backend.create_app({"MODEL_WARMUP": "eager"})
+    backend.services(app).llm_gateway.backend = StubBackend()
+
+    def post(i):
+        gender, _ = expected[i]
+        with app.test_client() as client:
+            resp = client.post(
+                "/analyze",
+                data={"gender": gender, "age": "16-25", "image": (io.BytesIO(uploads[i]), f"{i}.jpg")},
+                content_type="multipart/form-data",
+            )
+        return i, resp.status_code, resp.get_json()
+
+    mismatches = []
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for i, status, body in pool.map(post, range(n_requests)):
+            gender, skin_tone = expected[i]
+            if status != 200:
+                mismatches.append((i, f"status {status}: {body}"))
+            elif body["skin_tone"] != skin_tone or body["detected_gender"] != gender:
+                mismatches.append((i, f"expected {skin_tone}/{gender}, got {body['skin_tone']}/{body['detected_gender']}"))
+
+    distinct = len({skin_tone for _, skin_tone in expected})
+    print(f"{n_requests} requests, {n_workers} workers, {distinct} distinct inputs, {len(mismatches)} mismatches")
+    for i, reason in mismatches[:10]:
+        print(f"  request {i}: {reason}")
+
+    stage_mismatches = check_validation_stages(app)
+    print(f"validation stages on /analyze and /analyze/batch: {len(stage_mismatches)} mismatches")
+    for reason in stage_mismatches:
+        print(f"  {reason}")
+    return not mismatches and not stage_mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300, help="number of uploads to send")
+    parser.add_argument("--workers", type=int, default=32, help="number of concurrent client threads")
+    args = parser.parse_args(argv)
+    return 0 if run(args.requests, args.workers) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
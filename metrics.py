@@ -0,0 +1,197 @@
+"""
+Per-stage latency instrumentation exposed in Prometheus text format.
+
+    with span("decode"):
+        frame = decode_image(data)
+
+Every span feeds the styleai_stage_duration_seconds histogram. Inside a
+Flask request it is also listed in that response's Server-Timing header,
+which init_app() adds together with per-endpoint request counters and
+latency histograms.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by label values."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labelvalues, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, labelvalues)), value
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, optionally split by label values."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._series = {}  # labelvalues -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for labelvalues, series in sorted(snapshot.items()):
+            labels = dict(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, series[-2]
+            yield f"{self.name}_count", labels, series[-1]
+
+
+class MetricsRegistry:
+    """
+    Holds the process's metrics and renders them for /metrics.
+    Collectors are callables run at scrape time for values that live
+    elsewhere (cache counters, queue depth); each returns a list of
+    (name, kind, help, [(labels, value), ...]).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collector in self._collectors:
+            for name, kind, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "styleai_stage_duration_seconds", "Time spent in each analysis stage.", ("stage",))
+REQUEST_SECONDS = registry.histogram(
+    "styleai_request_duration_seconds", "Time to produce a response, by endpoint.", ("endpoint",))
+REQUESTS = registry.counter(
+    "styleai_requests_total", "HTTP requests served, by endpoint and status code.", ("endpoint", "status"))
+REJECTIONS = registry.counter(
+    "styleai_rejections_total", "Uploads rejected before the LLM stage, by reason.", ("reason",))
+
+
+@contextmanager
+def span(stage):
+    """Time a block as one pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        if has_request_context():
+            timings = g.get("server_timing")
+            if timings is not None:
+                timings.append((stage, elapsed))
+
+
+def cache_collector(*caches):
+    """Collector exposing TieredCache hit/miss counters."""
+    def collect():
+        samples = []
+        for cache in caches:
+            for result in ("memory_hits", "disk_hits", "misses"):
+                samples.append(({"cache": cache.name, "result": result}, getattr(cache, result)))
+        return [("styleai_cache_lookups_total", "counter", "Cache lookups by cache and outcome.", samples)]
+    return collect
+
+
+def init_app(app):
+    """Count and time every request and add a Server-Timing header to each response."""
+
+    @app.before_request
+    def _start_timer():
+        g.server_timing = []
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.get("request_start")
+        if start is None:
+            return response
+        total = time.perf_counter() - start
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUESTS.inc(endpoint, str(response.status_code))
+        REQUEST_SECONDS.observe(total, endpoint)
+        entries = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in g.server_timing]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        response.headers["Server-Timing"] = ", ".join(entries)
+        return response
@@ -0,0 +1,174 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+import detectors
+
+MODEL_DIR = os.getenv("MODEL_DIR", os.path.dirname(os.path.abspath(__file__)))
+
+# paths for optional OpenCV gender classification model
+GENDER_PROTO = os.path.join(MODEL_DIR, "deploy_gender.prototxt")
+GENDER_MODEL = os.path.join(MODEL_DIR, "gender_net.caffemodel")
+GENDER_URLS = {
+    GENDER_PROTO: "https://raw.githubusercontent.com/caffe/models/master/gender_net/deploy_gender.prototxt",
+    GENDER_MODEL: "https://github.com/caffe/models/raw/master/gender_net/gender_net.caffemodel",
+}
+
+# how many model sets may be checked out at once; each one holds its own
+# copy of the gender net, so this also bounds memory
+POOL_SIZE = int(os.getenv("MODEL_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+
+
+def download_models(names=None):
+    """Download the gender net and the face detector files that are not present yet.
+
+    This is the only code path that touches the network; run it once with
+    `flask --app backend fetch-models` or `python models.py fetch-models`
+    (add names such as `yunet ssd` for some of them) when provisioning a
+    machine, never from a request or at startup.
+    - names: "gender" and/or detector engine names; None means all of them
+    """
+    import urllib.request
+    wanted = {"gender": GENDER_URLS}
+    for name, engine in detectors.ENGINES.items():
+        wanted[name] = {path: url for path, url in zip(engine.paths(MODEL_DIR), engine.files.values()) if url}
+    for name in names or wanted:
+        if name not in wanted:
+            print(f"Unknown model {name!r}; choose from {', '.join(wanted)}")
+            continue
+        for fname, url in wanted[name].items():
+            if os.path.exists(fname):
+                continue
+            try:
+                print(f"Downloading {fname}...")
+                urllib.request.urlretrieve(url, fname)
+                print(f"Downloaded {fname}")
+            except Exception as e:
+                print(f"Failed to download {fname}: {e}")
+
+
+class VisionModels:
+    """
+    One set of OpenCV models owned by a single thread at a time.
+    cv2 cascades and dnn nets keep per-call state, so a set is never used
+    by two requests concurrently; ModelRegistry hands them out.
+    """
+
+    def __init__(self, detector_engine, detector_blobs, gender_proto, gender_weights):
+        self.face_detector = detector_engine(detector_blobs)
+
+        self.gender_net = None
+        if gender_proto is not None and gender_weights is not None:
+            self.gender_net = cv2.dnn.readNetFromCaffe(gender_proto, gender_weights)
+
+    def warm_up(self):
+        """Run one throwaway inference so the first real request pays no setup cost."""
+        self.face_detector.warm_up()
+        if self.gender_net is not None:
+            self.gender_net.setInput(np.zeros((1, 3, 227, 227), dtype=np.float32))
+            self.gender_net.forward()
+
+
+class ModelRegistry:
+    """
+    Loads model files from local disk once and keeps a bounded pool of warm
+    VisionModels instances.
+    - load() picks the face detector engine (FACE_DETECTOR), reads the files
+      into memory and pre-builds `size` warm instances
+    - acquire() checks one instance out for the calling thread
+    - ready reports whether load() has finished
+    """
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = max(1, size)
+        self.ready = False
+        self.has_gender_net = False
+        self.face_detector = None
+        self._detector_engine = None
+        self._detector_blobs = None
+        self._gender_proto = None
+        self._gender_weights = None
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        with self._load_lock:
+            if self.ready:
+                return self
+            self._load_detector(detectors.FACE_DETECTOR)
+            if os.path.exists(GENDER_PROTO) and os.path.exists(GENDER_MODEL):
+                self._gender_proto = np.fromfile(GENDER_PROTO, dtype=np.uint8)
+                self._gender_weights = np.fromfile(GENDER_MODEL, dtype=np.uint8)
+                try:
+                    self._idle.put(self._build())
+                    self.has_gender_net = True
+                except cv2.error as e:
+                    print("Error loading gender net:", e)
+                    self._gender_proto = self._gender_weights = None
+            else:
+                print("(Tip) deploy_gender.prototxt and/or gender_net.caffemodel missing; using heuristics.")
+                print("Run `flask --app backend fetch-models` once to download them, or place them in", MODEL_DIR)
+            while self._idle.qsize() < self.size:
+                self._idle.put(self._build())
+            self.ready = True
+        return self
+
+    def _load_detector(self, name):
+        if name == "auto":
+            name = detectors.choose_engine(MODEL_DIR)
+        engine = detectors.ENGINES[name]
+        if not engine.available(MODEL_DIR):
+            print(f"(Tip) face detector {name!r} needs {', '.join(engine.paths(MODEL_DIR))}; using haar.")
+            print(f"Run `flask --app backend fetch-models {name}` once to download it.")
+            engine = detectors.HaarDetector
+        blobs = engine.read_files(MODEL_DIR)
+        try:
+            engine(blobs)
+        except (cv2.error, RuntimeError) as e:
+            print(f"Error loading face detector {engine.name}:", e)
+            engine = detectors.HaarDetector
+            blobs = engine.read_files(MODEL_DIR)
+        self._detector_engine = engine
+        self._detector_blobs = blobs
+        self.face_detector = engine.name
+        print(f"Face detector: {engine.name}")
+
+    def _build(self):
+        models = VisionModels(self._detector_engine, self._detector_blobs, self._gender_proto, self._gender_weights)
+        models.warm_up()
+        return models
+
+    @contextmanager
+    def acquire(self):
+        """Check out a warm VisionModels; blocks while all `size` are in use."""
+        if not self.ready:
+            self.load()
+        self._slots.acquire()
+        try:
+            try:
+                models = self._idle.get_nowait()
+            except queue.Empty:
+                models = self._build()
+            try:
+                yield models
+            finally:
+                self._idle.put(models)
+        finally:
+            self._slots.release()
+
+
+registry = ModelRegistry()
+
+
+if __name__ == "__main__":
+    import sys
+    args = sys.argv[1:]
+    # `python models.py fetch-models [names]`; the bare form still works
+    if args[:1] == ["fetch-models"]:
+        args = args[1:]
+    download_models(args)
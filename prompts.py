@@ -0,0 +1,40 @@
+GENDERS = ("Male", "Female")
+
+# Age-specific prompt modifications
+AGE_CONTEXT = {
+    "0-9": "child-friendly, playful, colorful styles",
+    "10-15": "trendy youth styles, mix of comfort and fashion",
+    "16-25": "modern, stylish, contemporary looks",
+    "25+": "sophisticated, professional, timeless styles"
+}
+# the Streamlit client sends "25-above"; fold it into the same profile
+AGE_ALIASES = {"25-above": "25+"}
+AGE_GROUPS = tuple(AGE_CONTEXT)
+
+
+def build_prompt(skin_label, gender, age_group):
+    age_desc = AGE_CONTEXT.get(age_group, "contemporary")
+    return f"""
+    User Profile:
+    - Skin Tone: {skin_label}
+    - Gender: {gender}
+    - Age Group: {age_group} ({age_desc})
+
+    Provide personalized styling recommendations for this person:
+    1. Recommended Dress Codes (Formal, Business, Casual, Party)
+    2. Outfit combinations suitable for {age_desc}
+    3. Hairstyle and grooming suggestions
+    4. Accessories recommendations appropriate for their age
+    5. Color palette that complements their skin tone
+    6. Explain why these recommendations work for their profile
+
+    Make recommendations age-appropriate and skin-tone specific.
+    """
+
+
+def prompt_profiles():
+    """Every (skin_label, gender, age_group) the app can build a prompt for."""
+    # skin_tone needs cv2; only the offline table builder gets here
+    from skin_tone import SKIN_TONE_LABELS
+
+    return [(skin, gender, age) for skin in SKIN_TONE_LABELS for gender in GENDERS for age in AGE_GROUPS]
@@ -0,0 +1,247 @@
+"""
+Precomputed recommendations for every prompt profile.
+
+There are only 5 skin tones x 2 genders x 4 age groups = 40 prompts, so they
+are generated offline into a small SQLite artifact:
+
+    python recommendation_table.py build                 # fill in missing and stale rows
+    python recommendation_table.py build --variants 3    # up to 3 answers per profile
+    python recommendation_table.py refresh --max-age-days 30
+    python recommendation_table.py status
+
+A row is stale when build_prompt() or the model changed since it was
+generated (its prompt hash no longer matches) or it is older than
+--max-age-days; build and refresh only call the LLM for those rows. The
+server reads the file once at startup, read-only, and keeps the rows in a
+dict, so a lookup costs a dict access.
+"""
+import argparse
+import hashlib
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from prompts import build_prompt, prompt_profiles
+
+RECOMMENDATION_TABLE = os.getenv(
+    "RECOMMENDATION_TABLE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "recommendations.db"))
+# bumped when the artifact's schema changes; older files are ignored
+TABLE_FORMAT = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS recommendations (
+    skin_label TEXT NOT NULL,
+    gender TEXT NOT NULL,
+    age_group TEXT NOT NULL,
+    variant INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    generated_at REAL NOT NULL,
+    PRIMARY KEY (skin_label, gender, age_group, variant)
+);
+"""
+
+
+def prompt_hash(skin_label, gender, age_group, model):
+    """Fingerprint of what a row was generated from; a change makes the row stale."""
+    return hashlib.sha256(f"{model}\n{build_prompt(skin_label, gender, age_group)}".encode()).hexdigest()[:16]
+
+
+class RecommendationTable:
+    """
+    Read-only view of the artifact, loaded once.
+    - get() returns one stored answer for a profile (a random variant), or
+      None when the profile is missing or its rows are stale
+    - hits/misses count lookups for /cache/stats
+    """
+
+    def __init__(self, rows=None, meta=None):
+        self._rows = rows or {}
+        self.meta = meta or {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=RECOMMENDATION_TABLE, model=None):
+        """Load the artifact at `path`; a missing or incompatible file gives an empty table."""
+        if not os.path.exists(path):
+            return cls()
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            if meta.get("format") != str(TABLE_FORMAT):
+                print(f"Ignoring {path}: format {meta.get('format')}, expected {TABLE_FORMAT}")
+                return cls()
+            rows = {}
+            for skin, gender, age, text, row_hash, row_model in conn.execute(
+                    "SELECT skin_label, gender, age_group, text, prompt_hash, model FROM recommendations "
+                    "ORDER BY variant"):
+                # rows built from an older prompt are not served
+                if row_hash != prompt_hash(skin, gender, age, row_model) or (model and row_model != model):
+                    continue
+                rows.setdefault((skin, gender, age), []).append(text)
+        except sqlite3.DatabaseError as e:
+            print(f"Ignoring {path}: {e}")
+            return cls()
+        finally:
+            conn.close()
+        return cls({key: tuple(texts) for key, texts in rows.items()}, meta)
+
+    def get(self, skin_label, gender, age_group):
+        texts = self._rows.get((skin_label, gender, age_group))
+        if not texts:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return texts[0] if len(texts) == 1 else random.choice(texts)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def stats(self):
+        return {
+            "profiles": len(self._rows),
+            "built_at": self.meta.get("built_at"),
+            "model": self.meta.get("model"),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def open_for_build(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(_SCHEMA)
+    fmt = conn.execute("SELECT value FROM meta WHERE key = 'format'").fetchone()
+    if fmt is not None and fmt[0] != str(TABLE_FORMAT):
+        # an old layout is rebuilt from scratch
+        conn.execute("DELETE FROM recommendations")
+    return conn
+
+
+def stale_entries(conn, model, variants, max_age_days=None):
+    """(skin, gender, age, variant) rows that are missing or need regenerating."""
+    existing = {
+        (skin, gender, age, variant): (row_hash, row_model, generated_at)
+        for skin, gender, age, variant, row_hash, row_model, generated_at in conn.execute(
+            "SELECT skin_label, gender, age_group, variant, prompt_hash, model, generated_at FROM recommendations")
+    }
+    cutoff = time.time() - max_age_days * 86400 if max_age_days else None
+    todo = []
+    for skin, gender, age in prompt_profiles():
+        expected = prompt_hash(skin, gender, age, model)
+        for variant in range(variants):
+            row = existing.get((skin, gender, age, variant))
+            if row is None or row[0] != expected or row[1] != model or (cutoff and row[2] < cutoff):
+                todo.append((skin, gender, age, variant))
+    return todo
+
+
+def build(path=RECOMMENDATION_TABLE, variants=1, max_age_days=None, force=False, workers=4, gateway=None):
+    """Generate the missing and stale rows; returns (generated, failed)."""
+    import llm
+
+    gateway = gateway or llm.LLMGateway(llm.make_backend())
+    conn = open_for_build(path)
+    if force:
+        conn.execute("DELETE FROM recommendations")
+    todo = stale_entries(conn, gateway.model, variants, max_age_days)
+    print(f"{len(todo)} of {len(prompt_profiles()) * variants} entries to generate")
+
+    def generate(entry):
+        skin, gender, age, variant = entry
+        try:
+            # a little more temperature on extra variants so they differ
+            text = gateway.complete(build_prompt(skin, gender, age), temperature=0.7 + 0.1 * variant)
+        except llm.LLMError as e:
+            print(f"  {skin}/{gender}/{age} #{variant}: {e}")
+            return entry, None
+        return entry, text
+
+    generated = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (skin, gender, age, variant), text in pool.map(generate, todo):
+            if text is None:
+                failed += 1
+                continue
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO recommendations VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (skin, gender, age, variant, text, prompt_hash(skin, gender, age, gateway.model),
+                     gateway.model, time.time()),
+                )
+            generated += 1
+    with conn:
+        # variants beyond the requested count are dropped
+        conn.execute("DELETE FROM recommendations WHERE variant >= ?", (variants,))
+        conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+            ("format", str(TABLE_FORMAT)),
+            ("model", gateway.model),
+            ("variants", str(variants)),
+            ("built_at", time.strftime("%Y-%m-%dT%H:%M:%S%z")),
+        ])
+    conn.close()
+    print(f"{generated} generated, {failed} failed -> {path}")
+    return generated, failed
+
+
+def status(path=RECOMMENDATION_TABLE, max_age_days=None):
+    import llm
+
+    if not os.path.exists(path):
+        print(f"{path} does not exist; run `python recommendation_table.py build`")
+        return
+    conn = open_for_build(path)
+    meta = dict(conn.execute("SELECT key, value FROM meta"))
+    variants = int(meta.get("variants", "1"))
+    todo = stale_entries(conn, llm.LLM_MODEL, variants, max_age_days)
+    conn.close()
+    print(f"{path}: format {meta.get('format')}, model {meta.get('model')}, built {meta.get('built_at')}")
+    print(f"{len(prompt_profiles()) * variants - len(todo)} fresh, {len(todo)} missing or stale")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the precomputed recommendation table.")
+    parser.add_argument("--path", default=RECOMMENDATION_TABLE)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build_cmd = sub.add_parser("build", help="generate missing and stale entries")
+    build_cmd.add_argument("--variants", type=int, default=1, help="answers to keep per profile")
+    build_cmd.add_argument("--force", action="store_true", help="regenerate every entry")
+    build_cmd.add_argument("--workers", type=int, default=4, help="concurrent LLM calls")
+    build_cmd.add_argument("--max-age-days", type=float, help="also regenerate entries older than this")
+
+    refresh = sub.add_parser("refresh", help="regenerate only stale entries, keeping the variant count")
+    refresh.add_argument("--workers", type=int, default=4)
+    refresh.add_argument("--max-age-days", type=float, help="treat entries older than this as stale")
+
+    stat = sub.add_parser("status", help="show how many entries are fresh")
+    stat.add_argument("--max-age-days", type=float)
+
+    args = parser.parse_args(argv)
+    if args.command == "status":
+        status(args.path, args.max_age_days)
+        return 0
+    if args.command == "refresh":
+        conn = open_for_build(args.path)
+        row = conn.execute("SELECT value FROM meta WHERE key = 'variants'").fetchone()
+        conn.close()
+        variants = int(row[0]) if row else 1
+        _, failed = build(args.path, variants, args.max_age_days, workers=args.workers)
+    else:
+        _, failed = build(args.path, args.variants, args.max_age_days, args.force, args.workers)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
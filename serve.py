@@ -0,0 +1,111 @@
+"""
+Production server: pre-fork gunicorn workers that share models loaded once.
+
+    python serve.py
+    python serve.py --workers 4 --bind 0.0.0.0:8000
+
+The master process builds the app with MODEL_WARMUP=eager, which reads and
+warms the models, before forking, so every worker starts ready and shares the model memory
+copy-on-write. Cores are split between the layers so they do not
+oversubscribe each other:
+
+    workers x VISION_WORKERS (vision threads per worker) x OpenCV threads ~= cores
+
+Each worker also runs --threads request threads, which mostly wait on Groq
+and on SSE clients rather than on the CPU. /metrics counters are per
+worker process.
+
+An /analyze?async=1 job runs in the worker that accepted it, but the poll
+for it may reach any worker, so job states go through a SQLite file all
+workers share: JOB_DB, else CACHE_DB, else a temporary file that lives as
+long as the server.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import cv2
+
+CPU_COUNT = os.cpu_count() or 1
+
+
+def plan_threads(cpu_count, workers, vision_workers=None):
+    """
+    Split `cpu_count` cores between worker processes, vision threads and
+    OpenCV's own pool. Returns (vision_workers, cv2_threads) per worker.
+    """
+    workers = max(1, workers)
+    if vision_workers is None:
+        vision_workers = max(1, cpu_count // workers)
+    cv2_threads = max(1, cpu_count // (workers * vision_workers))
+    return vision_workers, cv2_threads
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the backend with pre-forked gunicorn workers.")
+    parser.add_argument("--bind", default=os.getenv("BIND", "0.0.0.0:5000"))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_WORKERS", str(CPU_COUNT))),
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("WEB_THREADS", "8")),
+                        help="request threads per worker")
+    parser.add_argument("--timeout", type=int, default=int(os.getenv("WEB_TIMEOUT", "120")),
+                        help="seconds before a silent worker is restarted")
+    args = parser.parse_args(argv)
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        # gunicorn is POSIX-only; on Windows use `python backend.py`
+        print("serve.py needs gunicorn: pip install gunicorn", file=sys.stderr)
+        return 1
+
+    env_vision = os.getenv("VISION_WORKERS")
+    vision_workers, cv2_threads = plan_threads(CPU_COUNT, args.workers, int(env_vision) if env_vision else None)
+    # jobs and models read these at import time, so set them before backend loads
+    os.environ["VISION_WORKERS"] = str(vision_workers)
+    os.environ.setdefault("MODEL_POOL_SIZE", str(vision_workers))
+    cv2.setNumThreads(cv2_threads)
+
+    import backend
+    config = {"MODEL_WARMUP": "eager"}
+    job_dir = None
+    if args.workers > 1 and not (os.getenv("JOB_DB") or os.getenv("CACHE_DB")):
+        job_dir = tempfile.TemporaryDirectory(prefix="styleai-jobs-")
+        config["JOB_DB"] = os.path.join(job_dir.name, "jobs.sqlite")
+    app = backend.create_app(config)
+
+    def post_fork(server, worker):
+        # OpenCV's thread pool does not survive fork(); size the child's explicitly
+        cv2.setNumThreads(cv2_threads)
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in {
+                "bind": args.bind,
+                "workers": args.workers,
+                "worker_class": "gthread",
+                "threads": args.threads,
+                "timeout": args.timeout,
+                "preload_app": True,
+                "post_fork": post_fork,
+            }.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    print(f"Serving on {args.bind}: {args.workers} workers x {args.threads} threads, "
+          f"{vision_workers} vision threads and {cv2_threads} OpenCV threads per worker")
+    master_pid = os.getpid()
+    try:
+        Server().run()
+    finally:
+        # workers leave through this frame too (SystemExit after fork)
+        if job_dir is not None and os.getpid() == master_pid:
+            job_dir.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,46 +1,132 @@
+import math
+from dataclasses import dataclass
+
 import cv2
 import numpy as np
 
-def detect_skin_tone(image_path):
+# YCrCb range that covers human skin across the whole tone scale
+SKIN_YCRCB_LOW = np.array([0, 133, 77], dtype=np.uint8)
+SKIN_YCRCB_HIGH = np.array([255, 173, 127], dtype=np.uint8)
+# the sampled region is shrunk to at most this side first; a median does
+# not need every pixel of a 1600 px face
+SAMPLE_MAX_SIDE = 128
+# with fewer skin pixels than this the mask is ignored and the whole region is used
+MIN_SKIN_PIXELS = 50
+
+# Individual Typology Angle lower bounds, lightest label first; anything
+# below the last bound is "Deep"
+ITA_LABELS = ((55, "Fair"), (41, "Light"), (28, "Medium"), (10, "Tan"))
+SKIN_TONE_LABELS = ("Fair", "Light", "Medium", "Tan", "Deep")
+
+
+@dataclass(frozen=True)
+class SkinTone:
+    """
+    Result of detect_skin_tone().
+    - label: one of SKIN_TONE_LABELS
+    - rgb: median skin colour, 0-255 ints
+    - lab: the same colour in CIE L*a*b* (L* 0-100)
+    - ita: Individual Typology Angle in degrees, which drives the label
+    - confidence: 0-1, how much of the sampled region looked like skin
+      (halved when no face box was available)
     """
-    Simple skin-tone estimator using OpenCV.
-    - reads the image, converts to RGB
-    - samples the central face region for an average color
-    - computes perceived brightness (luma) and returns a label.
+    label: str
+    rgb: tuple
+    lab: tuple
+    ita: float
+    confidence: float
+
+    def __str__(self):
+        # the display format the frontends already parse
+        r, g, b = self.rgb
+        return f"{self.label} (R={r},G={g},B={b})"
 
-    The thresholds are intentionally generous; feel free to tune
-    or replace this heuristic with a proper face detector and ML model.
+    def to_dict(self):
+        return {
+            "label": self.label,
+            "rgb": list(self.rgb),
+            "lab": list(self.lab),
+            "ita": self.ita,
+            "confidence": self.confidence,
+        }
+
+
+def ita_label(ita):
+    for bound, label in ITA_LABELS:
+        if ita > bound:
+            return label
+    return "Deep"
+
+
+def detect_skin_tone(frame, face_box=None):
+    """
+    Skin-tone estimator using OpenCV.
+    - samples the inner part of `face_box` (the box from face detection, in
+      frame.bgr coordinates), or the central 50% of the image without one
+    - keeps only skin-coloured pixels with a YCrCb mask and takes their
+      per-channel median, which ignores hair, glasses and background
+    - converts the median to Lab and labels it by ITA angle
+    Returns a SkinTone, or None when there is no frame.
     """
-    img = cv2.imread(image_path)
-    if img is None:
-        return "Unknown"
-
-    # convert BGR->RGB
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-    h, w, _ = img.shape
-    # sample central box (25%-75% horizontally/vertically)
-    y1, y2 = h//4, (3*h)//4
-    x1, x2 = w//4, (3*w)//4
-    region = img[y1:y2, x1:x2]
+    if frame is None:
+        return None
+
+    img = frame.bgr
+    h, w = img.shape[:2]
+    if face_box is not None:
+        x, y, fw, fh = face_box
+        # trim the forehead/hairline and the box sides, which catch background
+        region = img[y + fh // 5:y + fh * 9 // 10, x + fw // 6:x + fw * 5 // 6]
+        box_weight = 1.0
+    else:
+        # sample central box (25%-75% horizontally/vertically)
+        region = img[h // 4:(3 * h) // 4, w // 4:(3 * w) // 4]
+        box_weight = 0.5
     if region.size == 0:
         region = img
 
-    avg = region.reshape(-1, 3).mean(axis=0)
-    r, g, b = avg.tolist()
-    luma = 0.2126*r + 0.7152*g + 0.0722*b
-
-    # more granular thresholds to avoid most people landing in "Medium"
-    if luma >= 220:
-        label = "Fair"
-    elif luma >= 180:
-        label = "Light"
-    elif luma >= 140:
-        label = "Medium"
-    elif luma >= 100:
-        label = "Tan"
-    else:
-        label = "Deep"
+    rh, rw = region.shape[:2]
+    if max(rh, rw) > SAMPLE_MAX_SIDE:
+        factor = SAMPLE_MAX_SIDE / max(rh, rw)
+        region = cv2.resize(region, (max(1, int(rw * factor)), max(1, int(rh * factor))), interpolation=cv2.INTER_AREA)
+
+    mask = cv2.inRange(cv2.cvtColor(region, cv2.COLOR_BGR2YCrCb), SKIN_YCRCB_LOW, SKIN_YCRCB_HIGH)
+    pixels = region[mask > 0]
+    coverage = len(pixels) / (region.shape[0] * region.shape[1])
+    if len(pixels) < MIN_SKIN_PIXELS:
+        pixels = region.reshape(-1, 3)
+        coverage = 0.0
+
+    b, g, r = np.median(pixels, axis=0)
+    return skin_tone_from_bgr(b, g, r, box_weight * min(1.0, coverage / 0.5))
+
 
-    rgb = f"R={int(r)},G={int(g)},B={int(b)}"
-    return f"{label} ({rgb})"
\ No newline at end of file
+def skin_tone_from_bgr(b, g, r, confidence):
+    """Label a median skin colour (0-255 channels) by its ITA angle."""
+    bgr_unit = np.array([[[b, g, r]]], dtype=np.float32) / 255.0
+    lightness, a_star, b_star = (float(v) for v in cv2.cvtColor(bgr_unit, cv2.COLOR_BGR2Lab)[0, 0])
+    ita = math.degrees(math.atan2(lightness - 50, b_star))
+
+    return SkinTone(
+        label=ita_label(ita),
+        rgb=(int(r), int(g), int(b)),
+        lab=(round(lightness, 2), round(a_star, 2), round(b_star, 2)),
+        ita=round(ita, 2),
+        confidence=round(confidence, 3),
+    )
+
+
+def aggregate_skin_tones(tones):
+    """
+    One SkinTone for several samples of the same face, e.g. video frames:
+    the per-channel median colour, relabelled, with the median confidence.
+    A median ignores the odd frame caught mid-blink or in a lighting flicker.
+    Returns None without samples.
+    """
+    tones = [tone for tone in tones if tone is not None]
+    if not tones:
+        return None
+    if len(tones) == 1:
+        return tones[0]
+    r, g, b = np.median([tone.rgb for tone in tones], axis=0)
+    return skin_tone_from_bgr(b, g, r, float(np.median([tone.confidence for tone in tones])))
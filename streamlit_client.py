@@ -0,0 +1,76 @@
+"""
+Helpers shared by the Streamlit frontends (app.py and ui.py).
+
+- prepare_upload() shrinks a photo to the resolution the backend analyzes
+  and re-encodes it as JPEG, so a 12 MP phone photo goes out as a few
+  hundred KB instead of several MB
+- http_session() is one pooled requests.Session per Streamlit server, so
+  uploads reuse keep-alive connections instead of opening a new one each
+- image_digest() is what results are memoized under (with the profile) in
+  each frontend's st.cache_data function, so a rerun of the script does
+  not send the same photo to the backend again
+"""
+import hashlib
+import io
+import math
+import os
+
+import requests
+import streamlit as st
+from PIL import Image, ImageOps
+
+# long side of the photo sent to the backend. The backend decodes big photos
+# at a reduced scale down to image_frame.DETAIL_MAX_SIDE and runs its
+# whole-image checks on a 640 px copy, so pixels beyond this are never used.
+UPLOAD_MAX_SIDE = int(os.getenv("UPLOAD_MAX_SIDE", "1600"))
+UPLOAD_JPEG_QUALITY = int(os.getenv("UPLOAD_JPEG_QUALITY", "90"))
+# memoized analyses kept per Streamlit server, and for how long (seconds)
+RESULT_CACHE_ENTRIES = 128
+RESULT_CACHE_TTL = 3600
+
+
+class BackendError(Exception):
+    """A backend failure worth retrying (5xx, failed job); raised so it is not memoized."""
+
+
+def image_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def prepare_upload(data, mimetype, filename, max_side=UPLOAD_MAX_SIDE):
+    """
+    Shrink a photo to `max_side` and re-encode it as JPEG.
+    Returns (bytes, mimetype, filename). The original is sent unchanged
+    when it is already a small enough JPEG, when the re-encoded copy would
+    not be smaller, or when Pillow cannot read it (the backend then answers
+    with its usual error).
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            if max(width, height) <= max_side and image.format == "JPEG":
+                return data, mimetype, filename
+            scale = min(1.0, max_side / max(width, height))
+            # JPEGs are decoded at a reduced DCT scale, no smaller than the target
+            image.draft("RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+            # the backend applies EXIF orientation and the re-encoded copy has no EXIF
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+            buf = io.BytesIO()
+            image.save(buf, "JPEG", quality=UPLOAD_JPEG_QUALITY)
+    except (OSError, Image.DecompressionBombError):
+        return data, mimetype, filename
+    encoded = buf.getvalue()
+    if len(encoded) >= len(data):
+        return data, mimetype, filename
+    return encoded, "image/jpeg", os.path.splitext(filename)[0] + ".jpg"
+
+
+@st.cache_resource
+def http_session():
+    """requests.Session shared by every browser session of this Streamlit server."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
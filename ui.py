@@ -1,9 +1,81 @@
 import streamlit as st
 import requests
-import time
+import json
+
+from streamlit_client import RESULT_CACHE_ENTRIES, RESULT_CACHE_TTL, http_session, image_digest, prepare_upload
 
 st.set_page_config(page_title="Styling AI", layout="wide")
 
+BACKEND_URL = "http://127.0.0.1:5000"
+
+
+def read_events(resp):
+    """Yield (event, data) pairs from a text/event-stream response as they arrive."""
+    event, data_lines = "message", []
+    for line in resp.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[5:].strip())
+        elif not line and data_lines:
+            yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+
+
+@st.cache_data(show_spinner=False, max_entries=RESULT_CACHE_ENTRIES, ttl=RESULT_CACHE_TTL)
+def remembered_analysis(image_hash, gender, age, _events=None):
+    """
+    Events of a finished analysis of this photo and profile.
+    Called without _events it only looks up: a miss raises LookupError,
+    which st.cache_data does not store. Once a live stream has completed it
+    is called again with the events, which stores them for later reruns.
+    """
+    if _events is None:
+        raise LookupError(image_hash)
+    return _events
+
+
+def show_analysis(events):
+    """Render (event, data) pairs as they arrive, live or remembered; returns the ones shown."""
+    shown = []
+    recs_box = None
+    recommendations = ""
+    for event, result in events:
+        shown.append((event, result))
+        if event == "rejected":
+            st.error(f"⚠️ {result.get('error', 'Analysis failed')}")
+        elif event == "profile":
+            st.success("✅ Analysis Complete!")
+            
+            # Display results
+            st.markdown("---")
+            st.subheader("📊 Your Style Profile")
+            
+            col_a, col_b, col_c = st.columns(3)
+            with col_a:
+                st.metric("Skin Tone", result.get("skin_tone", "Unknown"))
+            with col_b:
+                st.metric("Gender", result.get("gender", ""))
+            with col_c:
+                st.metric("Age Group", result.get("age_group", ""))
+            
+            st.markdown("---")
+            st.subheader("👗 Recommendations")
+            recs_box = st.empty()
+            
+            st.markdown("---")
+            st.subheader("🛍️ Shop Now")
+            amazon = result.get("amazon_link", {})
+            if st.button(f"🔗 {amazon.get('name', 'Shop Now')}", use_container_width=True):
+                st.markdown(f"[Click here to shop on Amazon]({amazon.get('url', 'https://amazon.com')})", unsafe_allow_html=True)
+        elif event == "token" and recs_box is not None:
+            recommendations += result["text"]
+            recs_box.write(recommendations)
+        elif event == "error":
+            st.error(f"❌ Error: {result.get('error')}")
+    return shown
+
+
 st.title("🪄 Styling AI - Personal Fashion Stylist")
 
 # Sidebar for input
@@ -22,53 +94,42 @@ with col1:
 
 with col2:
     st.subheader("Analysis")
-    if st.button("Analyze my style", key="analyze_btn", use_container_width=True):
+    # photo and profile of the last finished analysis: reruns (e.g. from the
+    # shop button) show it again from remembered_analysis without the backend
+    key = (image_digest(file.getvalue()), gender, age) if file else None
+    if st.button("Analyze my style", key="analyze_btn", use_container_width=True) or (
+            key is not None and st.session_state.get("analysis_key") == key):
         if not file:
             st.error("❌ Please upload a photo first")
         elif not gender:
             st.error("❌ Please select your gender")
         else:
-            with st.spinner("🔍 Analyzing your style..."):
-                try:
-                    files = {"image": (file.name, file.getvalue(), file.type)}
-                    data  = {"gender": gender, "age": age}
-                    resp  = requests.post("http://127.0.0.1:5000/analyze", data=data, files=files, timeout=30)
-                    
-                    if resp.status_code == 400:
-                        result = resp.json()
-                        st.error(f"⚠️ {result.get('error', 'Analysis failed')}")
-                    elif resp.status_code == 200:
-                        result = resp.json()
-                        if result.get("status") == "success":
-                            st.success("✅ Analysis Complete!")
-                            
-                            # Display results
-                            st.markdown("---")
-                            st.subheader("📊 Your Style Profile")
-                            
-                            col_a, col_b, col_c = st.columns(3)
-                            with col_a:
-                                st.metric("Skin Tone", result.get("skin_tone", "Unknown"))
-                            with col_b:
-                                st.metric("Gender", result.get("gender", ""))
-                            with col_c:
-                                st.metric("Age Group", result.get("age_group", ""))
-                            
-                            st.markdown("---")
-                            st.subheader("👗 Recommendations")
-                            st.write(result.get("recommendations", "No recommendations available"))
-                            
-                            st.markdown("---")
-                            st.subheader("🛍️ Shop Now")
-                            amazon = result.get("amazon_link", {})
-                            if st.button(f"🔗 {amazon.get('name', 'Shop Now')}", use_container_width=True):
-                                st.markdown(f"[Click here to shop on Amazon]({amazon.get('url', 'https://amazon.com')})", unsafe_allow_html=True)
-                            
-                    else:
-                        st.error(f"❌ Unexpected error: {resp.status_code}")
-                except requests.exceptions.ConnectionError:
-                    st.error("❌ Cannot connect to backend. Make sure `python backend.py` is running on port 5000")
-                except requests.exceptions.Timeout:
-                    st.error("❌ Request timed out. Backend taking too long to respond")
-                except Exception as e:
-                    st.error(f"❌ Error: {str(e)}")
\ No newline at end of file
+            try:
+                show_analysis(remembered_analysis(*key))
+            except LookupError:
+                with st.spinner("🔍 Analyzing your style..."):
+                    try:
+                        upload, mimetype, filename = prepare_upload(file.getvalue(), file.type, file.name)
+                        files = {"image": (filename, upload, mimetype)}
+                        data  = {"gender": gender, "age": age}
+                        # streamed variant: the profile arrives right away and the
+                        # recommendations follow chunk by chunk as they are generated
+                        resp  = http_session().post(f"{BACKEND_URL}/analyze/stream", data=data, files=files, stream=True, timeout=(5, 30))
+                        
+                        if resp.status_code == 400:
+                            shown = show_analysis([("rejected", resp.json())])
+                        elif resp.status_code == 200:
+                            shown = show_analysis(read_events(resp))
+                        else:
+                            shown = []
+                            st.error(f"❌ Unexpected error: {resp.status_code}")
+                        # only whole answers are kept; a failed stream is retried next time
+                        if shown and shown[-1][0] in ("rejected", "done"):
+                            remembered_analysis(*key, _events=shown)
+                            st.session_state.analysis_key = key
+                    except requests.exceptions.ConnectionError:
+                        st.error("❌ Cannot connect to backend. Make sure `python backend.py` is running on port 5000")
+                    except requests.exceptions.Timeout:
+                        st.error("❌ Request timed out. Backend taking too long to respond")
+                    except Exception as e:
+                        st.error(f"❌ Error: {str(e)}")
@@ -0,0 +1,150 @@
+"""
+Multipart uploads read into one buffer and handed on without copies.
+
+Werkzeug's default parser writes each file into a SpooledTemporaryFile and
+FileStorage.read() then copies it out as bytes. UploadRequest gives the
+parser an UploadBuffer instead:
+- up to UPLOAD_SPOOL_BYTES the file is appended to a bytearray; a body
+  declared larger than that goes straight to a temporary file
+- upload_view() returns the contents as a read-only memoryview (of the
+  bytearray, or of an mmap of the temporary file), which validation,
+  hashing and np.frombuffer -> cv2.imdecode all read in place
+The request body limit itself is Flask's MAX_CONTENT_LENGTH: werkzeug stops
+reading and raises RequestEntityTooLarge as soon as the body passes it,
+whether or not the client declared a Content-Length.
+"""
+import io
+import mmap
+import os
+import tempfile
+
+from flask import Request
+
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(4 * 1024 * 1024)))
+
+
+class UploadBuffer(io.RawIOBase):
+    """
+    Write-once file object the form parser streams one uploaded file into.
+    Writes always append; reads and seeks are only there for FileStorage
+    users that still want a stream.
+    """
+
+    def __init__(self, size_hint=None, spool_threshold=UPLOAD_SPOOL_BYTES):
+        self._spool_threshold = spool_threshold
+        self._memory = bytearray()
+        self._file = None
+        self._pos = 0
+        if size_hint and size_hint > spool_threshold:
+            self._spool()
+
+    @property
+    def spooled(self):
+        return self._file is not None
+
+    def _spool(self):
+        self._file = tempfile.TemporaryFile()
+        self._file.write(self._memory)
+        self._memory = bytearray()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def write(self, b):
+        if self._file is None and len(self._memory) + len(b) > self._spool_threshold:
+            self._spool()
+        if self._file is not None:
+            return self._file.write(b)
+        self._memory += b
+        return len(b)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if self._file is not None:
+            return self._file.seek(offset, whence)
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._memory)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._file.tell() if self._file is not None else self._pos
+
+    def readinto(self, b):
+        if self._file is not None:
+            return self._file.readinto(b)
+        chunk = memoryview(self._memory)[self._pos:self._pos + len(b)]
+        n = len(chunk)
+        b[:n] = chunk
+        self._pos += n
+        return n
+
+    def view(self):
+        """The whole upload as a read-only memoryview; it stays valid after close()."""
+        if self._file is None:
+            return memoryview(self._memory).toreadonly()
+        self._file.flush()
+        if os.fstat(self._file.fileno()).st_size == 0:
+            return memoryview(b"")
+        # the mapping holds its own handle, so the view outlives the file object
+        return memoryview(mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        # views handed out keep the old bytearray alive; drop ours
+        self._memory = bytearray()
+        super().close()
+
+
+class ViewReader(io.RawIOBase):
+    """
+    Seekable read-only file over a memoryview such as upload_view() returns,
+    for readers like zipfile that want a file object. Unlike the upload's
+    own stream it stays readable after the request closes its files, which
+    a streamed response may outlive.
+    """
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def readinto(self, b):
+        chunk = self._view[self._pos:self._pos + len(b)]
+        n = len(chunk)
+        b[:n] = chunk
+        self._pos += n
+        return n
+
+
+class UploadRequest(Request):
+    """Flask request whose multipart files are parsed into UploadBuffers."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadBuffer(content_length or total_content_length)
+
+
+def upload_view(file_storage):
+    """Contents of an uploaded file as a read-only memoryview, without copying when possible."""
+    stream = file_storage.stream
+    if isinstance(stream, UploadBuffer):
+        return stream.view()
+    return memoryview(stream.read())
@@ -0,0 +1,172 @@
+"""
+Cheap upload checks that run before any pixel is decoded.
+
+An upload goes through the stages in VALIDATION_STAGES order, cheapest
+first, and stops at the first failure:
+- size: byte count against MAX_UPLOAD_BYTES
+- content_type: the bytes must really be an allowed image format (the
+  client-declared type is only used to reject obvious non-images)
+- dimensions: width/height from the JPEG/PNG/WebP header against
+  MIN_IMAGE_SIDE and MAX_IMAGE_PIXELS, so decompression bombs are caught
+  without decoding them
+Every photo entry point runs them: /analyze, the /analyze/frames photos and
+each /analyze/batch image or zip member (batch.decode_source).
+The later vision stages (blur and face on a thumbnail, then the full decode
+for gender and skin tone) report their failures with the same Rejection
+codes.
+"""
+import os
+from dataclasses import dataclass
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# a whole /analyze body: the image plus the multipart boundaries and the other form fields
+MAX_REQUEST_BYTES = MAX_UPLOAD_BYTES + 64 * 1024
+MIN_IMAGE_SIDE = int(os.getenv("MIN_IMAGE_SIDE", "64"))
+# 64 MP leaves room for 48 MP phone cameras
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(64_000_000)))
+ALLOWED_IMAGE_TYPES = {t.strip() for t in os.getenv("ALLOWED_IMAGE_TYPES", "image/jpeg,image/png,image/webp").split(",")}
+# clips for POST /analyze/frames; browsers record webcam video as WebM
+ALLOWED_VIDEO_TYPES = {t.strip() for t in os.getenv("ALLOWED_VIDEO_TYPES", "video/mp4,video/quicktime,video/webm").split(",")}
+VALIDATION_STAGES = [s.strip() for s in os.getenv("VALIDATION_STAGES", "size,content_type,dimensions").split(",")
+                     if s.strip()]
+
+
+@dataclass(frozen=True)
+class Rejection:
+    """
+    Why an upload was turned away.
+    - code: stable machine-readable reason, e.g. "too_large" or "blurry"
+    - message: text for the user
+    - status: HTTP status to answer with
+    """
+    code: str
+    message: str
+    status: int = 400
+
+    def to_dict(self):
+        # `error` stays the human-readable text the frontends already show
+        return {"error": self.message, "code": self.code}
+
+
+NO_IMAGE = Rejection("no_image", "no image provided")
+BAD_GENDER = Rejection("bad_gender", "gender must be Male or Female")
+TOO_LARGE = Rejection("too_large", f"Image is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.", 413)
+UNSUPPORTED_TYPE = Rejection("unsupported_type", "Please upload a JPEG, PNG or WebP photo.", 415)
+TOO_SMALL = Rejection("too_small", f"Image is too small; it needs at least {MIN_IMAGE_SIDE} pixels per side.")
+TOO_MANY_PIXELS = Rejection("too_many_pixels", "Image resolution is too high. Please upload a smaller photo.", 413)
+UNREADABLE = Rejection("unreadable", "Could not read the uploaded file as an image.")
+BLURRY = Rejection("blurry", "Image is too blurry. Please upload a clearer photo.")
+NO_FACE = Rejection("no_face", "No face detected in the image. Please upload a clear selfie.")
+NO_FRAMES = Rejection("no_image", "no frames or video provided")
+BAD_ARCHIVE = Rejection("bad_archive", "archive is not a valid zip file")
+MEMBER_TOO_LARGE = Rejection(
+    "too_large", f"Every image in the archive must be at most {MAX_UPLOAD_BYTES // (1024 * 1024)} MB unpacked.", 413)
+UNSUPPORTED_VIDEO = Rejection("unsupported_type", "Please upload an MP4, MOV or WebM clip.", 415)
+NO_IMAGES = Rejection("no_image", "no images provided")
+
+
+# rejections whose limit is an app setting rather than a module constant
+def too_many_images(limit):
+    return Rejection("too_many_images", f"at most {limit} images per batch request", 413)
+
+
+def too_many_frames(limit):
+    return Rejection("too_many_frames", f"at most {limit} frames per request", 413)
+
+
+def archive_too_large(limit_bytes):
+    return Rejection("too_large", f"The archive may hold at most {limit_bytes // (1024 * 1024)} MB of images unpacked.", 413)
+
+
+def body_too_large(kind, limit_bytes):
+    return Rejection("too_large", f"A {kind} request may carry at most {limit_bytes // (1024 * 1024)} MB.", 413)
+
+
+def sniff_image_type(data):
+    """MIME type from the file's magic bytes, or None for unrecognized data."""
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def sniff_video_type(data):
+    """MIME type of a video container from its first bytes, or None."""
+    if data[4:8] == b"ftyp":
+        return "video/quicktime" if data[8:10] == b"qt" else "video/mp4"
+    if data[:4] == b"\x1a\x45\xdf\xa3":  # EBML header: WebM or Matroska
+        return "video/webm"
+    return None
+
+
+def check_size(data, declared_type):
+    if not data:
+        return UNREADABLE
+    if len(data) > MAX_UPLOAD_BYTES:
+        return TOO_LARGE
+    return None
+
+
+def check_content_type(data, declared_type):
+    if declared_type and not declared_type.startswith("image/") and declared_type != "application/octet-stream":
+        return UNSUPPORTED_TYPE
+    if sniff_image_type(data) not in ALLOWED_IMAGE_TYPES:
+        return UNSUPPORTED_TYPE
+    return None
+
+
+def check_dimensions(data, declared_type):
+    # imported here so that importing validation does not pull in cv2
+    from image_frame import read_image_size
+
+    size = read_image_size(data[:262144])
+    if size is None:
+        # not a format with a parsable header (or a truncated one); the
+        # decoder gets the final say
+        return None
+    width, height = size
+    if min(width, height) < MIN_IMAGE_SIDE:
+        return TOO_SMALL
+    if width * height > MAX_IMAGE_PIXELS:
+        return TOO_MANY_PIXELS
+    return None
+
+
+CHECKS = {
+    "size": check_size,
+    "content_type": check_content_type,
+    "dimensions": check_dimensions,
+}
+_unknown = set(VALIDATION_STAGES) - set(CHECKS)
+if _unknown:
+    raise ValueError(f"unknown VALIDATION_STAGES {sorted(_unknown)}; choose from {sorted(CHECKS)}")
+
+
+def check_content_length(length):
+    """Reject a request whose declared body size is over the limit before the form is parsed."""
+    if length is not None and length > MAX_REQUEST_BYTES:
+        return TOO_LARGE
+    return None
+
+
+def validate_clip(data, declared_type=None):
+    """Checks for an uploaded clip: not empty and really an allowed video container."""
+    if not data:
+        return UNREADABLE
+    if declared_type and not declared_type.startswith("video/") and declared_type != "application/octet-stream":
+        return UNSUPPORTED_VIDEO
+    if sniff_video_type(data) not in ALLOWED_VIDEO_TYPES:
+        return UNSUPPORTED_VIDEO
+    return None
+
+
+def validate_upload(data, declared_type=None, stages=None):
+    """Run the pre-decode checks in order; returns the first Rejection, or None if the upload passes."""
+    for name in VALIDATION_STAGES if stages is None else stages:
+        rejection = CHECKS[name](data, declared_type)
+        if rejection is not None:
+            return rejection
+    return None
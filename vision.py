@@ -0,0 +1,141 @@
+import os
+
+import cv2
+import numpy as np
+
+from metrics import span
+from models import registry as model_registry
+
+GENDER_CLASSES = ['Male', 'Female']
+# per-channel mean the Caffe gender net was trained with (BGR)
+GENDER_MEAN = (78.4263377603, 87.7689143744, 114.895847746)
+
+
+# Laplacian variance below this counts as blurry. It is measured on the
+# frame's analysis-size copy, so one threshold holds for any upload size:
+# a 48 MP photo and its 640 px thumbnail get the same verdict.
+BLUR_THRESHOLD = float(os.getenv("BLUR_THRESHOLD", "100"))
+
+
+def sharpness(frame):
+    """Laplacian variance of the frame's analysis-size copy; higher is sharper."""
+    # 8-bit input keeps the aperture-1 Laplacian within int16, and
+    # meanStdDev accumulates in double, so no float64 image is needed
+    laplacian = cv2.Laplacian(frame.small_gray, cv2.CV_16S)
+    _, stddev = cv2.meanStdDev(laplacian)
+    return float(stddev[0][0]) ** 2
+
+
+# Blur detection function
+def is_image_blurry(frame, threshold=BLUR_THRESHOLD):
+    if frame is None:
+        return True
+    return sharpness(frame) < threshold
+
+
+def find_face(frame, models):
+    """Largest face box (x, y, w, h) on frame.small_gray, in those coordinates, or None."""
+    faces = models.face_detector.detect(frame.small_gray)
+    if not faces:
+        return None
+    return max(faces, key=lambda f: f[2] * f[3])
+
+
+def detect_face(frame, models):
+    """
+    Return the largest face box (x, y, w, h) in the frame, or None if there is no face.
+    The detector scans the small analysis copy; the box is returned in full
+    `frame.bgr` coordinates so crops keep their detail.
+    """
+    box = find_face(frame, models)
+    return None if box is None else frame.to_full(box)
+
+
+def predict_genders(net, face_crops):
+    """
+    Classify BGR face crops with the gender net in one batched forward pass.
+    Returns a list of (gender, confidence), one per crop.
+    """
+    blob = cv2.dnn.blobFromImages(face_crops, 1.0, (227, 227), GENDER_MEAN, swapRB=False)
+    net.setInput(blob)
+    preds = net.forward()
+    results = []
+    for row in preds:
+        i = int(np.argmax(row))
+        results.append((GENDER_CLASSES[i], float(row[i])))
+    return results
+
+
+def estimate_gender_heuristic(frame, box):
+    """Rough gender guess from face geometry when the gender net is unavailable."""
+    (x, y, w, h) = box
+    face_gray = frame.gray[y:y+h, x:x+w]
+
+    aspect_ratio = w / (h + 0.001)
+    chin_roi = face_gray[int(h*0.7):, :]
+    chin_darkness = np.mean(chin_roi)
+    edges = cv2.Laplacian(face_gray, cv2.CV_64F)
+    edge_concentration = np.std(edges)
+    # debug print values
+    print(f"heuristics: aspect_ratio={aspect_ratio:.2f}, chin_darkness={chin_darkness:.1f}, edge_conc={edge_concentration:.1f}")
+    male_score = 0
+    female_score = 0
+    if aspect_ratio > 0.8:
+        male_score += 2
+    else:
+        female_score += 1
+    if chin_darkness < 110:
+        male_score += 1.5
+    if edge_concentration > 12:
+        male_score += 1
+    else:
+        female_score += 1
+    if male_score > female_score:
+        detected_gender = 'Male'
+        confidence = min(0.95, 0.5 + (male_score / 10.0))
+    else:
+        detected_gender = 'Female'
+        confidence = min(0.95, 0.5 + (female_score / 10.0))
+    return detected_gender, confidence
+
+
+def estimate_gender(frame, box, models):
+    """Estimate gender for one detected face, preferring the DNN over heuristics."""
+    if models.gender_net is not None:
+        (x, y, w, h) = box
+        return predict_genders(models.gender_net, [frame.bgr[y:y+h, x:x+w]])[0]
+    return estimate_gender_heuristic(frame, box)
+
+
+def analyze_face(frame):
+    """
+    Find the main face and estimate its gender in one pass over the frame.
+    Returns (box, detected_gender, confidence); all None if there is no face.
+    The box is in frame.bgr coordinates, ready for detect_skin_tone().
+    """
+    if frame is None:
+        return None, None, None
+
+    # face detection and the gender net come from the warm model pool; the
+    # checked-out set belongs to this request until the block exits
+    with model_registry.acquire() as models:
+        with span("face_detect"):
+            box = find_face(frame, models)
+        if box is None:
+            return None, None, None
+        # on a frame from open_image() this is where the full pixels get decoded
+        box = frame.to_full(box)
+        with span("gender"):
+            detected_gender, confidence = estimate_gender(frame, box, models)
+    return box, detected_gender, confidence
+
+
+def detect_face_and_estimate_gender(frame):
+    """
+    Detect face and estimate gender using either a small DNN if available or
+    fallback to simple heuristics.
+    Takes a decoded ImageFrame.
+    Returns (detected_gender, confidence) or (None, None) if no face.
+    """
+    _, detected_gender, confidence = analyze_face(frame)
+    return detected_gender, confidence